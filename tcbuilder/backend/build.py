@@ -4,6 +4,7 @@ Backend handling for build subcommand
 
 import os
 import copy
+import hashlib
 import logging
 import re
 import sys
@@ -14,6 +15,7 @@ from urllib.parse import urlparse, unquote
 from urllib.request import urlretrieve
 
 import jsonschema
+import requests
 import yaml
 
 from tcbuilder.backend.common import progress, get_file_sha256sum
@@ -24,6 +26,12 @@ from tcbuilder.errors import (PathNotExistError, InvalidDataError,
 
 DEFAULT_SCHEMA_FILE = "tcbuild.schema.yaml"
 
+# Size of the blocks in which remote files are downloaded and written to disk.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Timeouts, in seconds, to connect to an HTTP(S) server and to wait for data from it.
+DOWNLOAD_TIMEOUT = (30, 60)
+
 RELEASE_TO_PROD_MAP = {
     "nightly": "torizoncore-oe-prerelease-frankfurt",
     "monthly": "torizoncore-oe-prerelease-frankfurt",
@@ -135,6 +143,41 @@ def parse_remote(remote_str, infer_fname=True):
     return url, fname, cksum
 
 
+def _download_file(url, fname, progress_hook=None):
+    """Download a file, the same way as urlretrieve() but in larger blocks for HTTP(S)
+
+    :param url: Source URL for the file.
+    :param fname: Name of the file to write; if None a temporary file is created.
+    :param progress_hook: If specified, function called like urlretrieve()'s reporthook.
+    :returns: Tuple (file name, response headers, SHA-256 checksum of the file); the
+              checksum is None when it was not computed during the download.
+    """
+
+    if urlparse(url).scheme.lower() not in ("http", "https"):
+        # Other schemes (e.g. file:// or ftp://) are left to urllib.
+        out_fname, headers = urlretrieve(url, filename=fname, reporthook=progress_hook)
+        return out_fname, headers, None
+
+    # Stream the download to disk in large blocks, hashing it on the way.
+    with requests.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as res:
+        res.raise_for_status()
+        total_size = int(res.headers.get("Content-Length", -1))
+        if fname is None:
+            tmp_fd, fname = tempfile.mkstemp()
+            os.close(tmp_fd)
+        sha256 = hashlib.sha256()
+        if progress_hook:
+            progress_hook(0, DOWNLOAD_CHUNK_SIZE, total_size)
+        with open(fname, "wb") as outf:
+            chunks = res.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+            for blocknum, chunk in enumerate(chunks, start=1):
+                outf.write(chunk)
+                sha256.update(chunk)
+                if progress_hook:
+                    progress_hook(blocknum, DOWNLOAD_CHUNK_SIZE, total_size)
+        return fname, res.headers, sha256.hexdigest()
+
+
 def fetch_remote(url, fname=None, cksum=None, download_dir=None):
     """Fetch a remote file
 
@@ -190,8 +233,7 @@ def fetch_remote(url, fname=None, cksum=None, download_dir=None):
             log.info(f"Fetching URL '{url}' into '{in_fname}'")
 
         # Do actual download.
-        out_fname, headers = urlretrieve(
-            url, filename=in_fname, reporthook=progress_hook)
+        out_fname, headers, file_cksum = _download_file(url, in_fname, progress_hook)
         log.info("\nDownload Complete!")
         # log.debug(f"Downloaded {out_fname}, headers: {headers}")
 
@@ -219,7 +261,8 @@ def fetch_remote(url, fname=None, cksum=None, download_dir=None):
 
     # Ensure checksum matches expected one:
     if cksum is not None:
-        file_cksum = get_file_sha256sum(out_fname)
+        if file_cksum is None:
+            file_cksum = get_file_sha256sum(out_fname)
         if cksum != file_cksum:
             raise IntegrityCheckFailed(
                 f"Downloaded file sha256sum of '{file_cksum}' does not match "
@@ -10,7 +10,7 @@ import guestfs
 from tezi.image import ImageConfig
 from tcbuilder.backend.common import \
     (set_output_ownership, check_licence_acceptance,
-     run_with_loading_animation, DOCKER_BUNDLE_TARNAME)
+     run_with_loading_animation, DOCKER_BUNDLE_TARNAME, clone_tree)
 from tcbuilder.errors import InvalidStateError, InvalidDataError, TorizonCoreBuilderError
 
 log = logging.getLogger("torizon." + __name__)
@@ -238,7 +238,7 @@ def combine_tezi_image(image_dir, bundle_dir, output_directory, tezi_props, forc
                     "Rename output or use --force to overwrite.")
 
         log.info("Creating copy of source image.")
-        shutil.copytree(image_dir, output_directory)
+        clone_tree(image_dir, output_directory)
 
     # Notice that the present function can be used simply for updating the
     # metadata and not necessarily to add containers (so the function name
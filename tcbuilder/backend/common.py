@@ -1,8 +1,10 @@
+import functools
+import hashlib
 import ipaddress
 import json
 import logging
 import os
-import re
+import shutil
 import socket
 import subprocess
 import sys
@@ -33,6 +35,17 @@ log = logging.getLogger("torizon." + __name__)
 
 DOCKER_BUNDLE_TARNAME = "docker-storage.tar"
 
+# Multi-threaded replacements for the unpack commands, in order of preference; the first one
+# installed is used. Note that xz itself only decompresses in parallel from version 5.4 on.
+PARALLEL_UNPACK_COMMANDS = {
+    "gzip -dc": ("pigz -dc",),
+    "bzip2 -dc": ("pbzip2 -dc",),
+    "xz -dc": ("pixz -d", "xz -dc -T0"),
+}
+
+# Size of the blocks in which files are read for hashing, where hashlib.file_digest() is missing.
+HASH_BLOCK_SIZE = 1024 * 1024
+
 # Mapping from architecture to a Docker platform.
 ARCH_TO_DOCKER_PLAT = {
     "aarch64": "linux/arm64",
@@ -257,19 +270,16 @@ def add_common_registry_arguments(subparser):
 
 def get_unpack_command(filename):
     """Get shell command to unpack a given file format"""
-    cmd = "cat"
-    if filename.endswith(".gz") or filename.endswith(".tgz"):
-        cmd = "gzip -dc"
-    elif filename.endswith(".xz"):
-        cmd = "xz -dc"
-    elif filename.endswith(".lzo"):
-        cmd = "lzop -dc"
-    elif filename.endswith(".zst"):
-        cmd = "zstd -dc"
-    elif filename.endswith(".lz4"):
-        cmd = "lz4 -dc"
-    elif filename.endswith(".bz2"):
-        cmd = "bzip2 -dc"
+    # The extension to command table lives in tezi.utils; keep a single copy of it.
+    return tezi.utils.get_unpack_command(filename)
+
+
+@functools.lru_cache(maxsize=None)
+def get_parallel_unpack_command(cmd):
+    """Get the multi-threaded equivalent of unpack command 'cmd', if installed"""
+    for parallel_cmd in PARALLEL_UNPACK_COMMANDS.get(cmd, ()):
+        if shutil.which(parallel_cmd.split()[0]):
+            return parallel_cmd
     return cmd
 
 
@@ -281,7 +291,9 @@ def get_tar_compress_program_options(filename):
     # case.
     if cmd == "cat":
         return []
-    return ["--use-compress-program", cmd]
+    # Decompression is what bounds the extraction of big tarballs, so use all
+    # cores for it when possible.
+    return ["--use-compress-program", get_parallel_unpack_command(cmd)]
 
 
 def get_all_local_ip_addresses():
@@ -507,15 +519,16 @@ def progress(blocknum, blocksiz, totsiz, totbarsiz=40):
 
 def get_file_sha256sum(path):
     """Get SHA-256 checksum of a file"""
-    # Run external program - output is like this:
-    # c81be3dc13de2bd6e13da015e7822a4719aca3cc7434f24b564e40ff8c632a36 <fname>
-    text = subprocess.check_output(
-        ["sha256sum", path], shell=False, text=True, stderr=subprocess.STDOUT)
-    parts = re.split(r"\s+", text)
-    # Sanity checks:
-    assert (len(parts) >= 2) and (len(parts[0]) == 64)
-    # Return the SHA-256 checksum
-    return parts[0]
+    # Hash in-process: hashlib.file_digest() (Python 3.11+) reads the file in C without
+    # holding the GIL; older Pythons get a loop of large reads.
+    with open(path, "rb") as fileh:
+        if hasattr(hashlib, "file_digest"):
+            # pylint: disable=no-member
+            return hashlib.file_digest(fileh, "sha256").hexdigest()
+        sha256 = hashlib.sha256()
+        for block in iter(functools.partial(fileh.read, HASH_BLOCK_SIZE), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
 
 
 def get_own_container_id(
@@ -673,6 +686,20 @@ def get_file_ownership(filename):
     return stat.st_uid, stat.st_gid
 
 
+def clone_tree(src_dir, dst_dir):
+    """
+    Copy directory tree 'src_dir' to 'dst_dir' (which must not exist).
+
+    This is like shutil.copytree() but with copy-on-write clones of the files on
+    filesystems supporting them (cp silently falls back to a regular copy otherwise),
+    which makes copying big images nearly free there.
+    """
+    subprocess.check_output(
+        ["cp", "-r", "--reflink=auto", "--preserve=mode,timestamps",
+         "-T", src_dir, dst_dir],
+        stderr=subprocess.STDOUT)
+
+
 def set_output_ownership(output_file, set_parents=False):
     """
     Set ownership for any file and/or directory to the same ownership of
@@ -2,9 +2,11 @@
 Backend handling for the deploy subcommand.
 """
 
+import functools
 import json
 import logging
 import os
+import re
 import shutil
 import subprocess
 import threading
@@ -20,7 +22,7 @@ from gi.repository import Gio, OSTree
 
 from tcbuilder.backend import ostree
 from tcbuilder.backend.common import (get_rootfs_tarball, resolve_remote_host,
-                                      run_with_loading_animation)
+                                      run_with_loading_animation, clone_tree)
 from tcbuilder.backend.rforward import reverse_forward_tunnel, request_port_forward
 from tcbuilder.errors import TorizonCoreBuilderError, InvalidDataError
 from tezi.utils import find_rootfs_content
@@ -33,6 +35,11 @@ EXTRA_ROOTFS_SIZE_KB = 0
 # Value based on
 # https://github.com/torizon/meta-toradex-torizon/blob/953aacb8b3241ea26f98e853d1a1d4c8463636a4/recipes-images/images/torizon-core-common.inc#L11
 IMAGE_OVERHEAD_FACTOR = 2.3
+# Usual locations of grub.cfg inside the EFI directory (relative to "EFI/").
+EFI_GRUBCFG_SUBDIRS = ["BOOT", "torizon", "debian", "ubuntu", "fedora", "centos"]
+# Number of 512-byte blocks per record written by tar when packing the rootfs.
+TAR_BLOCKING_FACTOR = 2048
+
 
 def create_sysroot(deploy_sysroot_dir):
     sysroot = OSTree.Sysroot.new(Gio.File.new_for_path(deploy_sysroot_dir))
@@ -43,16 +50,23 @@ def create_sysroot(deploy_sysroot_dir):
     if not sysroot.init_osname(OSNAME):
         raise TorizonCoreBuilderError("Error initializing OSTree osname.")
 
+    # Loading cannot be skipped even though the sysroot has just been created: repo() and
+    # deploy_tree() require a loaded sysroot. On a fresh sysroot this is cheap anyway, since
+    # there are no deployments to enumerate yet.
     if not sysroot.load():
         raise TorizonCoreBuilderError("Error loading OSTree sysroot.")
 
     return sysroot
 
 
+@functools.lru_cache(maxsize=16)
 def get_image_bootloader(sysroot_dir):
     """
     Get bootloader being used in a given unpacked sysroot
 
+    The result is cached per sysroot path since the bootloader of an unpacked
+    image does not change while it is being deployed.
+
     :param sysroot_dir: sysroot path
 
     Based on:
@@ -74,6 +88,10 @@ def get_image_bootloader(sysroot_dir):
     tentative_efi_dir_path = os.path.join(sysroot_dir, "boot/efi/EFI")
     if (os.path.exists(tentative_efi_dir_path) and
             os.path.isdir(tentative_efi_dir_path)):
+        # Probe the usual locations first to avoid walking the whole EFI tree.
+        for subdir in EFI_GRUBCFG_SUBDIRS:
+            if os.path.exists(os.path.join(tentative_efi_dir_path, subdir, "grub.cfg")):
+                return "GRUB2"
         for _, _, files in os.walk(tentative_efi_dir_path):
             if "grub.cfg" in files:
                 return "GRUB2"
@@ -107,12 +125,12 @@ def deploy_rootfs(sysroot, src_sysroot_dir, ref, refspec, kargs):
     if not result:
         raise TorizonCoreBuilderError("Error creating deployment.")
 
-    # Create boot file to trigger U-Boot detection
-    bootdir = os.path.join(sysroot.get_path().get_path(), "boot")
-
-    os.makedirs(bootdir)
-    os.makedirs(os.path.join(bootdir, "loader.1"))
-    os.symlink("loader.1", os.path.join(bootdir, "loader"))
+    # Create boot file to trigger U-Boot detection. Everything is created relative to
+    # the directory fd that the (loaded) sysroot already keeps open for its root.
+    sysroot_fd = sysroot.get_fd()
+    os.mkdir("boot", dir_fd=sysroot_fd)
+    os.mkdir("boot/loader.1", dir_fd=sysroot_fd)
+    os.symlink("loader.1", "boot/loader", dir_fd=sysroot_fd)
 
     bootloader_found = get_image_bootloader(src_sysroot_dir)
 
@@ -121,12 +139,12 @@ def deploy_rootfs(sysroot, src_sysroot_dir, ref, refspec, kargs):
         os.environ["OSTREE_BOOT_PARTITION"] = "/boot"
         os.environ["OSTREE_GRUB2_EXEC"] = \
             "/builder/tcbuilder/ostree-grub-generator"
-        os.makedirs(os.path.join(bootdir, "grub2"))
-        os.symlink("../loader/grub.cfg", os.path.join(bootdir, "grub2/grub.cfg"))
+        os.mkdir("boot/grub2", dir_fd=sysroot_fd)
+        os.symlink("../loader/grub.cfg", "boot/grub2/grub.cfg", dir_fd=sysroot_fd)
     elif bootloader_found == "U-Boot":
         log.info("Bootloader found in unpacked image: U-Boot")
-        file = open(os.path.join(bootdir, "loader/uEnv.txt"), "w")
-        file.close()
+        os.close(os.open("boot/loader/uEnv.txt", os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o666, dir_fd=sysroot_fd))
     else:
         raise TorizonCoreBuilderError(
             "Aborting: Couldn't determine bootloader in unpacked image or "
@@ -140,20 +158,26 @@ def deploy_rootfs(sysroot, src_sysroot_dir, ref, refspec, kargs):
         raise TorizonCoreBuilderError("Error writing deployment.")
 
 
-def update_uncompressed_image_size(image_filename):
+def update_uncompressed_image_size(image_filename, uncompressed_size=None):
     """
     Update the 'uncompressed_size' field of the 'image.json' file.
 
     :param image_filename: Compressed image filename.
+    :param uncompressed_size: Size in bytes of the image before compression;
+                              when not passed, it is read from the compressed
+                              image itself.
     """
 
-    # '.zst' is the default compression used, but it can also be '.xz'
-    cmd = ["zstd", "-l", f"{image_filename}"]
-    if image_filename.endswith(".xz"):
-        cmd[0] = "xz"
+    if uncompressed_size is not None:
+        uncompressed_image_size = uncompressed_size / 1024 / 1024
+    else:
+        # '.zst' is the default compression used, but it can also be '.xz'
+        cmd = ["zstd", "-l", f"{image_filename}"]
+        if image_filename.endswith(".xz"):
+            cmd[0] = "xz"
 
-    output = subprocess.check_output(cmd)
-    uncompressed_image_size = output.split()[11] # Uncompressed field of zstd/xz -l
+        output = subprocess.check_output(cmd)
+        uncompressed_image_size = output.split()[11] # Uncompressed field (MiB) of zstd/xz -l
 
     image_json = os.path.join(os.path.dirname(image_filename), 'image.json')
     with open(image_json, "r", encoding="utf-8") as jsonfile:
@@ -175,17 +199,14 @@ def create_installed_versions(path, ref, branch):
         json.dump(versioninfo, versionfile)
 
 def copy_tezi_image(src_tezi_dir, dst_tezi_dir):
-    shutil.copytree(src_tezi_dir, dst_tezi_dir)
-
-def pack_rootfs_for_tezi(dst_sysroot_dir, output_dir):
-    image_filename = get_rootfs_tarball(output_dir)
+    clone_tree(src_tezi_dir, dst_tezi_dir)
 
+def pack_rootfs_for_tezi(dst_sysroot_dir, image_filename):
+    # Use as many compression threads as there are CPU cores (-T0).
     if image_filename.endswith(".xz"):
-        uncompressed_file = image_filename.replace(".xz", "")
-        compress_cmd = ["xz", "-z", uncompressed_file]
+        compress_cmd = ["xz", "-z", "-T0", "-q", "-c"]
     elif image_filename.endswith(".zst"):
-        uncompressed_file = image_filename.replace(".zst", "")
-        compress_cmd = ["zstd", "--rm", uncompressed_file]
+        compress_cmd = ["zstd", "-T0", "-q", "-c"]
 
     # pylint: disable=line-too-long
     # This is a OSTree bare repository. Care must been taken to preserve all
@@ -193,26 +214,50 @@ def pack_rootfs_for_tezi(dst_sysroot_dir, output_dir):
     # here.
     # See: https://dev.gentoo.org/~mgorny/articles/portability-of-tar-features.html#extended-file-metadata
     # pylint: enable=line-too-long
+    # ACLs and SELinux contexts are not used by OSTree, so make sure tar never
+    # spends time gathering them; the archive format is left to tar since the
+    # xattrs are stored in PAX headers. The archive is written to the pipe in
+    # 1 MiB records (instead of the default 10 KiB) to cut down on the number
+    # of write calls.
     tar_cmd = [
         "tar",
         "--xattrs", "--xattrs-include=*",
-        "-cf", uncompressed_file,
+        "--no-acls", "--no-selinux", "--sort=none",
+        "--totals", f"--blocking-factor={TAR_BLOCKING_FACTOR}",
+        "-cf", "-",
         "-S", "-C", dst_sysroot_dir,
         "-p", "."
     ]
-    log.debug(f"Running tar command: {shlex.join(tar_cmd)}")
-    subprocess.check_output(tar_cmd, stderr=subprocess.STDOUT)
-
-    log.debug(f"Running compress command: {shlex.join(compress_cmd)}")
-    subprocess.check_output(compress_cmd, stderr=subprocess.STDOUT)
-
-    update_uncompressed_image_size(image_filename)
 
-
-def copy_files_from_old_sysroot(src_sysroot, dst_sysroot):
+    # Stream the archive straight into the compressor so that both run
+    # concurrently and no uncompressed tarball is ever written to disk.
+    log.debug(f"Running command: {shlex.join(tar_cmd)} | {shlex.join(compress_cmd)}")
+    with open(image_filename, "wb") as image_file:
+        # pylint: disable=consider-using-with
+        tar_proc = subprocess.Popen(tar_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        compress_proc = subprocess.Popen(compress_cmd, stdin=tar_proc.stdout,
+                                         stdout=image_file, stderr=subprocess.PIPE)
+        # pylint: enable=consider-using-with
+        tar_proc.stdout.close()
+        _, tar_stderr = tar_proc.communicate()
+        _, compress_stderr = compress_proc.communicate()
+
+    if tar_proc.returncode != 0:
+        raise subprocess.CalledProcessError(tar_proc.returncode, tar_cmd, stderr=tar_stderr)
+    if compress_proc.returncode != 0:
+        raise subprocess.CalledProcessError(
+            compress_proc.returncode, compress_cmd, stderr=compress_stderr)
+
+    # Size of the uncompressed tarball as reported by tar's --totals
+    uncompressed_size = int(
+        re.search(rb"Total bytes written: (\d+)", tar_stderr).group(1))
+
+    update_uncompressed_image_size(image_filename, uncompressed_size)
+
+
+def copy_files_from_old_sysroot(src_path, dst_sysroot):
     # Call get_path twice to receive the local path instead of an
     # OSTree object
-    src_path = src_sysroot.get_path().get_path()
     dst_path = dst_sysroot.get_path().get_path()
     var_path = os.path.join("ostree/deploy", OSNAME, "var")
     copy_list = [
@@ -224,8 +269,11 @@ def copy_files_from_old_sysroot(src_sysroot, dst_sysroot):
         copy_list.append({"src": os.path.join(src_path, "boot.scr"), "dst": dst_path})
 
     for copy_file in copy_list:
-        # shutil.copytree does not preserve ownership
-        if subprocess.Popen(['cp', '-a', '-t', copy_file['dst'], copy_file['src']]).wait():
+        # shutil.copytree does not preserve ownership. Use CoW clones where the
+        # filesystem supports them; cp silently falls back to a regular copy
+        # otherwise.
+        if subprocess.Popen(['cp', '-a', '--reflink=auto', '--sparse=always',
+                             '-t', copy_file['dst'], copy_file['src']]).wait():
             raise TorizonCoreBuilderError("Cannot deploy home directories.")
 
 # pylint: disable=too-many-locals
@@ -242,6 +290,10 @@ def deploy_ostree_local(src_sysroot_dir, src_ostree_archive_dir,
     # Create a new sysroot for our deployment
     sysroot = create_sysroot(dst_sysroot_dir)
     repo = sysroot.repo()
+    # The deployment is packed into an image right afterwards, so there is no
+    # point in making its objects durable.
+    log.debug("Disabling fsync on the deployment repository.")
+    repo.set_disable_fsync(True)
 
     # We need to resolve the reference to a checksum again, otherwise
     # pull_local_ref complains with:
@@ -252,7 +304,7 @@ def deploy_ostree_local(src_sysroot_dir, src_ostree_archive_dir,
         raise TorizonCoreBuilderError(f"Error resolving {ref}.")
 
     # Get metadata from the commit being requested.
-    srcmeta, _subject, _body = ostree.get_metadata_from_ref(srcrepo, csumdeploy)
+    srcmeta, _subject, _body = ostree.get_metadata_from_checksum(srcrepo, csumdeploy)
     srckargs = srcmeta['oe.kargs-default']
 
     log.info(f"Pulling OSTree with ref {ref} from local archive repository...")
@@ -262,7 +314,7 @@ def deploy_ostree_local(src_sysroot_dir, src_ostree_archive_dir,
 
     target_refs = {ref: csumdeploy}
     ostree.pull_local_refs(repo, src_ostree_archive_dir, refs=target_refs,
-                           remote="torizon")
+                           remote="torizon", disable_fsync=True)
     log.info("Pulling done.")
 
     log.info(f"Deploying OSTree with checksum {csumdeploy}")
@@ -274,8 +326,7 @@ def deploy_ostree_local(src_sysroot_dir, src_ostree_archive_dir,
     # Currently we use the sysroot from the unpacked Tezi rootfs as source for
     # /home directories
     log.info("Copy files not under OSTree control from original deployment.")
-    src_sysroot = ostree.load_sysroot(src_sysroot_dir)
-    copy_files_from_old_sysroot(src_sysroot, sysroot)
+    copy_files_from_old_sysroot(src_sysroot_dir, sysroot)
 # pylint: enable=too-many-locals
 
 
@@ -290,28 +341,149 @@ def deploy_tezi_image(tezi_dir, src_sysroot_dir, src_ostree_archive_dir,
 
     log.info("Packing rootfs...")
     copy_tezi_image(tezi_dir, output_dir)
-    pack_rootfs_for_tezi(dst_sysroot_dir, output_dir)
+    pack_rootfs_for_tezi(dst_sysroot_dir, get_rootfs_tarball(output_dir))
     log.info("Packing rootfs done.")
 
 
-def write_rootfs_to_raw_image(base_raw_img, output_raw_img, base_rootfs_partition, rootfs_label,
-                              base_rootfs_partition_size_kb, other_partitions_size_kb,
-                              rootfs_size_kb, dst_sysroot_dir):
-    """Writes unpacked rootfs contents to an output raw image
+def _split_raw_partitions(table, base_rootfs_partition):
+    """Split the partitions of a base raw image into its rootfs and the ones to keep
 
-    Writes the current unpacked rootfs to a raw image that is based on
-    an input image. If the unpacked rootfs has a larger size than the base
-    rootfs partition the output image is increased accordingly.
+    :param table: "partitiontable" object of the base image, as dumped by 'sfdisk --json'.
+    :param base_rootfs_partition: Device of the rootfs partition (e.g. "/dev/sda2").
+    :returns: Tuple (rootfs, kept) with the rootfs partition and the list of the other
+              ones (sorted by partition number), or None if the layout is not supported.
     """
-    out_size_kb = max(base_rootfs_partition_size_kb, rootfs_size_kb * IMAGE_OVERHEAD_FACTOR)
-    out_size_kb += EXTRA_ROOTFS_SIZE_KB
-    out_size_kb += other_partitions_size_kb
+    if table["label"] not in ("gpt", "dos"):
+        log.debug(f"Unsupported partition table type '{table['label']}'.")
+        return None
+
+    def partition_number(part):
+        return int(re.search(r"(\d+)$", part["node"]).group(1))
+
+    rootfs_number = int(re.search(r"(\d+)$", base_rootfs_partition).group(1))
+    partitions = sorted(table["partitions"], key=partition_number)
+    if table["label"] == "dos" and any(partition_number(part) > 4 for part in partitions):
+        log.debug("Logical partitions are not supported.")
+        return None
+
+    rootfs = next((part for part in partitions
+                   if partition_number(part) == rootfs_number), None)
+    if rootfs is None:
+        return None
+    return rootfs, [part for part in partitions if part is not rootfs]
+
+
+def _raw_rootfs_start(kept, rootfs, sector_size):
+    """Get the first sector of the new rootfs partition of an output raw image
+
+    The partition goes after all kept partitions (and no earlier than the base rootfs
+    partition), aligned to 1 MiB.
+    """
+    align = (1024 * 1024) // sector_size
+    rootfs_start = max([part["start"] + part["size"] for part in kept] + [rootfs["start"]])
+    return -(-rootfs_start // align) * align
+
+
+def _sfdisk_script(table, kept, rootfs, rootfs_start):
+    """Build the sfdisk script of the partition table of an output raw image
+
+    :param table: "partitiontable" object of the base image, as dumped by 'sfdisk --json'.
+    :param kept: Partitions of the base image copied as-is to the output image.
+    :param rootfs: rootfs partition of the base image.
+    :param rootfs_start: First sector of the new rootfs partition, which takes the rest
+                         of the disk.
+    :returns: List with the lines of the script.
+    """
+    script = [f"label: {table['label']}", "unit: sectors"]
+    if "id" in table:
+        script.append(f"label-id: {table['id']}")
+    for part in kept + [dict(rootfs, start=rootfs_start, size=None, uuid=None)]:
+        fields = [f"start={part['start']}"]
+        if part["size"] is not None:
+            fields.append(f"size={part['size']}")
+        fields.append(f"type={part['type']}")
+        for key in ("uuid", "name", "attrs"):
+            if part.get(key):
+                fields.append(f'{key}="{part[key]}"')
+        if part.get("bootable"):
+            fields.append("bootable")
+        script.append(", ".join(fields))
+    return script
+
+
+def _copy_raw_image_regions(base_raw_img, output_raw_img, regions, sector_size):
+    """Copy the (start, size) sector regions of the base image to the same offsets of the output"""
+    for start, size in regions:
+        subprocess.check_output(
+            ["dd", f"if={base_raw_img}", f"of={output_raw_img}", "bs=1M",
+             "iflag=skip_bytes,count_bytes", "oflag=seek_bytes", "conv=notrunc,sparse",
+             f"skip={start * sector_size}", f"seek={start * sector_size}",
+             f"count={size * sector_size}"],
+            stderr=subprocess.STDOUT)
+
+
+def copy_raw_image_layout(base_raw_img, output_raw_img, base_rootfs_partition,
+                          rootfs_out_size_kb):
+    """Copy base image to output image, except for its rootfs partition
+
+    This does the same as 'virt-resize --delete' but without booting the
+    libguestfs appliance: the boot loader area and all partitions other than
+    the rootfs are copied as-is (at the same offsets) and an empty partition
+    taking the rest of the output image is created at the end of the disk.
+
+    :returns: True if the output image was created; False if the partition
+              layout of the base image is not supported by this method (in
+              which case no output image is left behind).
+    """
+    if not shutil.which("sfdisk"):
+        log.debug("sfdisk not available.")
+        return False
+
+    table = json.loads(
+        subprocess.check_output(["sfdisk", "--json", base_raw_img], text=True))["partitiontable"]
+    layout = _split_raw_partitions(table, base_rootfs_partition)
+    if layout is None:
+        return False
+    rootfs, kept = layout
+
+    sector_size = table.get("sectorsize", 512)
+    rootfs_start = _raw_rootfs_start(kept, rootfs, sector_size)
+    out_size = rootfs_start * sector_size + int(rootfs_out_size_kb * 1024)
+    # Leave room for the secondary GPT at the end of the disk.
+    out_size += 1024 * 1024
+
+    subprocess.check_output(["truncate", "-s", str(out_size), output_raw_img])
+    log.debug(f"Created empty output image: {output_raw_img}")
+    log.info(f"Size of output image will be: {out_size/1024/1024/1024:.2f} GiB")
+
+    log.info("Copying other partitions from base to output image...")
+    # Boot loader area (everything before the first partition) and kept partitions:
+    regions = [(0, min(part["start"] for part in kept + [rootfs]))]
+    regions.extend((part["start"], part["size"]) for part in kept)
+    _copy_raw_image_regions(base_raw_img, output_raw_img, regions, sector_size)
+
+    # New partition table: kept partitions plus a new rootfs one at the end.
+    script = "\n".join(_sfdisk_script(table, kept, rootfs, rootfs_start))
+    log.debug(f"Partition table of output image:\n{script}")
+    try:
+        subprocess.run(["sfdisk", "--no-reread", "--no-tell-kernel", output_raw_img],
+                       input=script + "\n", text=True, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except subprocess.CalledProcessError as exc:
+        # E.g. a kept partition that does not fit the new table: let virt-resize handle it.
+        log.debug(f"sfdisk could not write the partition table: {exc.stderr.strip()}")
+        os.unlink(output_raw_img)
+        return False
+    return True
+
+
+def _copy_raw_image_layout_virt_resize(base_raw_img, output_raw_img, base_rootfs_partition,
+                                       out_size_kb):
+    """Copy base image to output image, except for its rootfs partition, with virt-resize"""
 
     # Create new image file:
     subprocess.check_output(["truncate", "-s", f"+{int(out_size_kb)}K", output_raw_img])
     log.debug(f"Created empty output image: {output_raw_img}")
-    log.debug(f"Image overhead factor: {IMAGE_OVERHEAD_FACTOR}")
-    log.debug(f"Extra rootfs size added: {EXTRA_ROOTFS_SIZE_KB/1024} MiB")
 
     log.info(f"Size of output image will be: {out_size_kb/1024/1024:.2f} GiB")
 
@@ -323,6 +495,29 @@ def write_rootfs_to_raw_image(base_raw_img, output_raw_img, base_rootfs_partitio
     subprocess.run(resizecmd, check=True)
     log.info("------------------------------------------------------------")
 
+
+def write_rootfs_to_raw_image(base_raw_img, output_raw_img, base_rootfs_partition, rootfs_label,
+                              base_rootfs_partition_size_kb, other_partitions_size_kb,
+                              rootfs_size_kb, dst_sysroot_dir):
+    """Writes unpacked rootfs contents to an output raw image
+
+    Writes the current unpacked rootfs to a raw image that is based on
+    an input image. If the unpacked rootfs has a larger size than the base
+    rootfs partition the output image is increased accordingly.
+    """
+    rootfs_out_size_kb = max(base_rootfs_partition_size_kb,
+                             rootfs_size_kb * IMAGE_OVERHEAD_FACTOR)
+    rootfs_out_size_kb += EXTRA_ROOTFS_SIZE_KB
+    out_size_kb = rootfs_out_size_kb + other_partitions_size_kb
+
+    log.debug(f"Image overhead factor: {IMAGE_OVERHEAD_FACTOR}")
+    log.debug(f"Extra rootfs size added: {EXTRA_ROOTFS_SIZE_KB/1024} MiB")
+
+    if not copy_raw_image_layout(base_raw_img, output_raw_img, base_rootfs_partition,
+                                 rootfs_out_size_kb):
+        _copy_raw_image_layout_virt_resize(base_raw_img, output_raw_img, base_rootfs_partition,
+                                           out_size_kb)
+
     try:
         gfs = guestfs.GuestFS(python_return_dict=True)
         gfs.add_drive_opts(output_raw_img, format="raw")
@@ -330,7 +525,7 @@ def write_rootfs_to_raw_image(base_raw_img, output_raw_img, base_rootfs_partitio
             func=gfs.launch,
             loading_msg="Initializing output image...")
 
-        # virt-resize rearranged all existing partitions and generated a new empty partition at the
+        # The existing partitions were copied and a new empty partition was generated at the
         # end of the disk. We will format it to ext4 and put the unpacked rootfs contents in it.
 
         # Its partition number (/dev/sda1, /dev/sda2, etc.) is equal to the number of partitions
@@ -343,9 +538,8 @@ def write_rootfs_to_raw_image(base_raw_img, output_raw_img, base_rootfs_partitio
         gfs.set_label(output_rootfs_partition, rootfs_label)
         gfs.mount(output_rootfs_partition, "/")
 
-        dst_sysroot_dir_ls = os.listdir(dst_sysroot_dir)
-        if 'lost+found' in dst_sysroot_dir_ls:
-            dst_sysroot_dir_ls.remove('lost+found')
+        dst_sysroot_dir_ls = [entry.name for entry in os.scandir(dst_sysroot_dir)
+                              if entry.name != 'lost+found']
 
         log.info("Copying unpacked rootfs contents to output image. This may take a few minutes...")
         for content in dst_sysroot_dir_ls:
@@ -362,6 +556,29 @@ def write_rootfs_to_raw_image(base_raw_img, output_raw_img, base_rootfs_partitio
         raise TorizonCoreBuilderError(f"guestfs: {gfserr.args[0]}")
 
 
+def _raw_partition_sizes_kb(partitions, rootfs_partition):
+    """Get the sizes (in KiB) of the rootfs partition and of the other partitions combined.
+
+    :param partitions: Partitions as returned by guestfs' part_list().
+    :param rootfs_partition: Device name of the rootfs partition (e.g. "/dev/sda2").
+    """
+    # An MBR extended partition spans the logical partitions (numbered from 5) it holds:
+    # leave it out so that their space is not counted twice.
+    logical = [part for part in partitions if part["part_num"] > 4]
+    rootfs_size_kb = 0
+    others_size_kb = 0
+    for part in partitions:
+        if part["part_num"] <= 4 and any(
+                part["part_start"] <= lpart["part_start"] and
+                lpart["part_end"] <= part["part_end"] for lpart in logical):
+            continue
+        if f"/dev/sda{part['part_num']}" == rootfs_partition:
+            rootfs_size_kb = part["part_size"] / 1024
+        else:
+            others_size_kb += part["part_size"] / 1024
+    return rootfs_size_kb, others_size_kb
+
+
 def deploy_raw_image(base_raw_img, src_sysroot_dir, src_ostree_archive_dir,
                      output_raw_img, dst_sysroot_dir, rootfs_label, ref=None):
     """Deploys a WIC image with given OSTree reference
@@ -384,13 +601,9 @@ def deploy_raw_image(base_raw_img, src_sysroot_dir, src_ostree_archive_dir,
         rootfs_partition = gfs.findfs_label(rootfs_label)
         log.info(f"  '{rootfs_label}' partition found: {rootfs_partition}")
 
-        base_rootfs_partition_size_kb = gfs.blockdev_getsize64(rootfs_partition) / 1024
-
-        other_partitions_size_kb = 0
-        partitions = gfs.list_partitions()
-        partitions.remove(rootfs_partition)
-        for part in partitions:
-            other_partitions_size_kb += gfs.blockdev_getsize64(part) / 1024
+        # Get the size of all partitions with a single call to the appliance.
+        base_rootfs_partition_size_kb, other_partitions_size_kb = \
+            _raw_partition_sizes_kb(gfs.part_list("/dev/sda"), rootfs_partition)
 
         # Close read-only handle
         gfs.shutdown()
@@ -416,10 +629,40 @@ def deploy_raw_image(base_raw_img, src_sysroot_dir, src_ostree_archive_dir,
                               rootfs_size_kb, dst_sysroot_dir)
     log.info(f"Image {os.path.basename(output_raw_img)} created successfully!")
 
-def run_command_with_sudo(client, command, password):
-    stdin, stdout, stderr = client.exec_command("sudo -S -- " + command)
+def validate_sudo_credentials(client, password):
+    """
+    Validate the sudo credentials of the remote user once.
+
+    :param client: Connected paramiko.SSHClient.
+    :param password: Password of the remote user.
+    :returns:
+        True if the credentials are cached across SSH sessions, so that later
+        sudo calls need no password; False otherwise (e.g. when sudo keeps
+        its timestamps per terminal or per parent process).
+    """
+    stdin, stdout, stderr = client.exec_command("sudo -S -v")
     stdin.write(f"{password}\n")
     stdin.flush()
+    if stdout.channel.recv_exit_status() != 0:
+        stderr_str = stderr.read().decode('utf-8').strip()
+        if len(stderr_str) > 0:
+            log.error(stderr_str)
+        raise TorizonCoreBuilderError("Failed to validate sudo credentials on module.")
+
+    _stdin, stdout, _stderr = client.exec_command("sudo -n true")
+    cached = stdout.channel.recv_exit_status() == 0
+    log.debug(f"sudo credentials cached across sessions: {cached}")
+    return cached
+
+
+def run_command_with_sudo(client, command, password, cached=False):
+    if cached:
+        # Credentials already validated by validate_sudo_credentials().
+        _stdin, stdout, stderr = client.exec_command("sudo -n -- " + command)
+    else:
+        stdin, stdout, stderr = client.exec_command("sudo -S -- " + command)
+        stdin.write(f"{password}\n")
+        stdin.flush()
     status = stdout.channel.recv_exit_status()  # wait for exec_command to finish
 
     stdout_str = stdout.read().decode('utf-8').strip()
@@ -461,12 +704,8 @@ def deploy_ostree_remote(remote_host, remote_username, remote_password, remote_p
     srckargs = srcmeta['oe.kargs-default']
 
     # Create kargs arguments based on metadata
-    args_list = ['--karg-none']
-    for arg in shlex.split(srckargs):
-        arg = f"--karg-append={arg}"
-        args_list.append(arg)
-
-    args_cli = shlex.join(args_list)
+    args_cli = shlex.join(
+        ["--karg-none"] + [f"--karg-append={arg}" for arg in shlex.split(srckargs)])
 
     log.info(f"Pulling OSTree with ref {ref} (checksum {csumdeploy}) "
              "from local archive repository...")
@@ -488,6 +727,8 @@ def deploy_ostree_remote(remote_host, remote_username, remote_password, remote_p
                    password=remote_password,
                    port=remote_port)
 
+    sudo_cached = validate_sudo_credentials(client, remote_password)
+
     # Get the reverse TCP port that was chosen by the remote SSH
     reverse_ostree_server_port = request_port_forward(client.get_transport())
 
@@ -502,32 +743,33 @@ def deploy_ostree_remote(remote_host, remote_username, remote_password, remote_p
         client,
         "ostree remote add --no-gpg-verify --force tcbuilder "
         f"http://localhost:{reverse_ostree_server_port}/",
-        remote_password)
+        remote_password, sudo_cached)
 
     log.info("Starting OSTree pull on the device...")
     run_command_with_sudo(
-        client, f"ostree pull tcbuilder:{csumdeploy}", remote_password)
+        client, f"ostree pull tcbuilder:{csumdeploy}", remote_password, sudo_cached)
 
     log.info("Deploying new OSTree on the device...")
     # Do the final staging after we set upgrade_available, therefore option --stage
     run_command_with_sudo(
-        client, f"ostree admin deploy --stage {args_cli} tcbuilder:{csumdeploy}", remote_password)
+        client, f"ostree admin deploy --stage {args_cli} tcbuilder:{csumdeploy}",
+        remote_password, sudo_cached)
 
     # Make sure we set bootcount to 0, it can be > 1 from previous runs
     run_command_with_sudo(
-        client, "fw_setenv bootcount 0", remote_password)
+        client, "fw_setenv bootcount 0", remote_password, sudo_cached)
 
     # Make sure we remove the rollback flag from previous runs
     run_command_with_sudo(
-        client, "fw_setenv rollback 0", remote_password)
+        client, "fw_setenv rollback 0", remote_password, sudo_cached)
 
     # Set upgrade_available for U-Boot
     run_command_with_sudo(
-        client, "fw_setenv upgrade_available 1", remote_password)
+        client, "fw_setenv upgrade_available 1", remote_password, sudo_cached)
 
     # Finalize the update after we set upgrade_available for U-Boot
     run_command_with_sudo(
-        client, "ostree admin finalize-staged", remote_password)
+        client, "ostree admin finalize-staged", remote_password, sudo_cached)
 
     log.info("Deploying successfully finished.")
 
@@ -535,7 +777,7 @@ def deploy_ostree_remote(remote_host, remote_username, remote_password, remote_p
         # If reboot is started in foreground it leads to exit code <> 0 sometimes
         # which leads to a stack trace in torizoncore-builder. Start in background
         # to make the command run successfully always.
-        run_command_with_sudo(client, "sh -c 'reboot &'", remote_password)
+        run_command_with_sudo(client, "sh -c 'reboot &'", remote_password, sudo_cached)
         log.info("Device reboot initiated...")
     else:
         log.info("Please reboot the device to boot into the new deployment.")
@@ -2,16 +2,32 @@
 Backend for the DT (device-tree) related operations.
 """
 
+import fnmatch
+import functools
 import logging
 import json
 import os
-import shlex
+import re
 import subprocess
 import sys
+import tempfile
 import io
 
+from tcbuilder.errors import PathNotExistError
+
 log = logging.getLogger("torizon." + __name__)
 
+# Base command lines of the device tree preprocessing and compilation steps.
+CPP_CMD = ["cpp", "-nostdinc", "-undef", "-x", "assembler-with-cpp"]
+DTC_CMD = ["dtc", "-I", "dts", "-O", "dtb", "-@"]
+
+# Anything in a device tree source that needs the C preprocessor: its directives (but not
+# properties such as "#address-cells") and dtc's own /include/, which is resolved relative
+# to the preprocessed stream.
+CPP_DIRECTIVE_REGEX = re.compile(
+    rb"^[ \t]*#[ \t]*(?:include|define|undef|ifdef|ifndef|if|elif|else|endif|error|warning|"
+    rb"pragma|line)\b|/include/", re.MULTILINE)
+
 
 def get_dt_changes_dir(storage_dir):
     '''Returns the directory that contains external device tree related changes.'''
@@ -26,16 +42,25 @@ def get_current_uenv_txt_path(storage_dir):
         return path
     # Fallback to uEnv.txt from the base image.
     path = os.path.join(storage_dir, "sysroot", "boot", "loader", "uEnv.txt")
-    assert os.path.exists(path), "panic: missing uEnv.txt in base image!"
+    if not os.path.exists(path):
+        raise PathNotExistError("panic: missing uEnv.txt in base image!")
     return path
 
 
 def get_uboot_initial_env_path(storage_dir):
     '''Get the path to u-boot-initial-env-sd, the initial bootloader environment set by Tezi.'''
+    return _get_uboot_initial_env_path(os.path.abspath(storage_dir))
+
+
+# The base image does not change during a run, so lookups on it are cached.
+@functools.lru_cache(maxsize=None)
+def _get_uboot_initial_env_path(storage_dir):
     image_json_path = os.path.join(storage_dir, "tezi", "image.json")
-    assert os.path.exists(image_json_path), "panic: missing image.json in Tezi directory!"
-    with open(image_json_path, "r") as jsonf:
-        image_json = json.load(jsonf)
+    try:
+        with open(image_json_path, "r") as jsonf:
+            image_json = json.load(jsonf)
+    except FileNotFoundError as exc:
+        raise PathNotExistError("panic: missing image.json in Tezi directory!") from exc
     try:
         initial_env_basename = image_json["u_boot_env"]
     except KeyError:
@@ -43,23 +68,24 @@ def get_uboot_initial_env_path(storage_dir):
     assert initial_env_basename, \
         "panic: missing 'u_boot_env' key in image.json in Tezi directory!"
     initial_env_path = os.path.join(storage_dir, "tezi", initial_env_basename)
-    assert os.path.exists(initial_env_path), \
-        f"panic: missing {initial_env_basename} in Tezi directory!"
+    if not os.path.exists(initial_env_path):
+        raise PathNotExistError(f"panic: missing {initial_env_basename} in Tezi directory!")
     return initial_env_path
 
 
 def query_variable_in_config_file(name, path):
     '''Query the value of variable 'name' in configuration file 'path'.
        Returns an empty string if the variable does not exist in the file.'''
-    proc = subprocess.run(
-        ["sed", "-e", f"/^{name}=/!d", "-e", "s/^[^=]*=//", "-e", "q", path],
-        check=False, capture_output=True, text=True)
-    if proc.returncode != 0:
+    try:
+        with open(path, "r") as conf_file:
+            contents = conf_file.read()
+    except OSError as exc:
         # This Should Never Happen (TM)
-        log.error(proc.stderr)
+        log.error(str(exc))
         log.error(f"error: cannot search file '{os.path.basename(path)}'! -- missing 'unpack'?")
         sys.exit(1)
-    return proc.stdout.strip()
+    match = re.search(rf"^{re.escape(name)}=(.*)$", contents, re.MULTILINE)
+    return match.group(1).strip() if match else ""
 
 
 def get_current_dtb_basename(storage_dir):
@@ -80,18 +106,61 @@ def get_current_dtb_basename(storage_dir):
     return None
 
 
+def find_first(root, pattern, want_dir=False):
+    '''Find the first file (or directory if 'want_dir') under 'root' whose name matches the
+       shell pattern 'pattern'; this is the same as "find root -type f|d -name pattern -print
+       -quit". Returns None if there is no match.'''
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        return None
+    for entry in entries:
+        # The file types come from the directory listing, so no stat is needed.
+        is_dir = entry.is_dir(follow_symlinks=False)
+        if fnmatch.fnmatchcase(entry.name, pattern):
+            if (is_dir if want_dir else entry.is_file(follow_symlinks=False)):
+                return entry.path
+        if is_dir:
+            answer = find_first(entry.path, pattern, want_dir)
+            if answer:
+                return answer
+    return None
+
+
 def get_dtb_kernel_subdir(storage_dir):
     '''Returns "usr/lib/modules/<kernel_version/dtb".'''
+    return _get_dtb_kernel_subdir(os.path.abspath(storage_dir))
 
-    answer = subprocess.check_output(
-        ("set -o pipefail && "
-         f"find {storage_dir}/sysroot/ostree/deploy -type d -name dtb -print -quit |"
-         " sed -r -e 's|.*/(usr/lib/modules/)|\\1|'"),
-        shell=True, text=True).strip()
+
+@functools.lru_cache(maxsize=None)
+def _get_dtb_kernel_subdir(storage_dir):
+    answer = _get_base_dtb_dir(storage_dir)
+    _, sep, subdir = answer.rpartition("/usr/lib/modules/")
+    return "usr/lib/modules/" + subdir if sep else answer
+
+
+@functools.lru_cache(maxsize=None)
+def _get_base_dtb_dir(storage_dir):
+    '''Returns the full path to the kernel device tree directory of the base image.'''
+    answer = find_first(os.path.join(storage_dir, "sysroot", "ostree", "deploy"),
+                        "dtb", want_dir=True)
     assert answer, "panic: missing kernel device tree directory!"
     return answer
 
 
+def _find_base_dtb(storage_dir, pattern):
+    '''Find a device tree blob of the base image whose name matches 'pattern'.
+
+    The (cached) kernel device tree directory is searched first, which is where blobs
+    normally live; only if nothing is found there the whole deployment tree is walked.
+    '''
+    storage_dir = os.path.abspath(storage_dir)
+    answer = find_first(_get_base_dtb_dir(storage_dir), pattern)
+    if answer:
+        return answer
+    return find_first(os.path.join(storage_dir, "sysroot", "ostree", "deploy"), pattern)
+
+
 def get_current_dtb_path(storage_dir):
     '''Query the path to the currently applied device tree blob.
 
@@ -112,52 +181,81 @@ def get_current_dtb_path(storage_dir):
             # This is a recently applied device tree.
             return (answer, True)
         # This is a device tree from the base image.
-        answer = subprocess.check_output(
-            ["find", f"{storage_dir}/sysroot/ostree/deploy", "-type", "f",
-             "-name", dtb_basename, "-print", "-quit"],
-            text=True).strip()
-        assert os.path.exists(answer), f"panic: missing device tree blob file for {dtb_basename}!"
+        answer = _find_base_dtb(storage_dir, dtb_basename)
+        assert answer, f"panic: missing device tree blob file for {dtb_basename}!"
         return (answer, True)
 
     # Cannot identify the device tree by peeking the boot loader configuration.
     # Hint by returning the first device tree blob found in the base image.
-    answer = subprocess.check_output(
-        ["find", f"{storage_dir}/sysroot/ostree/deploy", "-type", "f",
-         "-name", "*.dtb", "-print", "-quit"],
-        text=True).strip()
-    assert os.path.exists(answer), "panic: missing device tree blobs in base image!"
+    answer = _find_base_dtb(storage_dir, "*.dtb")
+    assert answer, "panic: missing device tree blobs in base image!"
     return (answer, False)
 
 
+def is_dtb(path):
+    '''Check whether file 'path' is a device tree blob by looking at its magic number.'''
+    # pylint: disable=line-too-long
+    # file does not necessarily return Device tree blob as file type. Therefore,
+    # check Device tree blob magic. See:
+    # https://github.com/devicetree-org/devicetree-specification/releases/download/v0.3/devicetree-specification-v0.3.pdf
+    # pylint: enable=line-too-long
+    with io.open(path, 'rb') as dtbf:
+        return int.from_bytes(dtbf.read(4), 'big') == 0xd00dfeed
+
+
+@functools.lru_cache(maxsize=8)
+def _cpp_include_flags(include_dirs):
+    '''Returns the cpp options for searching the tuple of directories 'include_dirs'.'''
+    return tuple(flag for include_dir in include_dirs for flag in ("-I", include_dir))
+
+
 def build_dts(source_dts_path, include_dirs, target_dtb_path):
     '''Compile the device tree source file 'source_dts_path' to 'target_dtb_path'.
        Returns True on successful compilation, False otherwise.
    '''
-    opt_includes = []
-    for include_dir in include_dirs:
-        opt_includes.append("-I")
-        opt_includes.append(shlex.quote(include_dir))
-    opt_includes = " ".join(opt_includes)
     try:
-        subprocess.check_output(
-            ("set -o pipefail && "
-             f"cpp -nostdinc -undef -x assembler-with-cpp {opt_includes} "
-             f"{shlex.quote(source_dts_path)} "
-             f"| dtc -I dts -O dtb -@ -o {shlex.quote(target_dtb_path)}"),
-            shell=True, text=True, stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as exc:
-        log.error(exc.output.strip())
+        with open(source_dts_path, "rb") as dtsf:
+            needs_cpp = CPP_DIRECTIVE_REGEX.search(dtsf.read()) is not None
+    except OSError as exc:
+        log.error(f"error: cannot read '{source_dts_path}': {exc.strerror}")
         return False
-    # pylint: disable=line-too-long
-    # file does not necessarily return Device tree blob as file type. Therefore,
-    # check Device tree blob magic. See:
-    # https://github.com/devicetree-org/devicetree-specification/releases/download/v0.3/devicetree-specification-v0.3.pdf
-    # pylint: enable=line-too-long
-    with io.open(target_dtb_path, 'rb') as dtbf:
-        dtb_check = int.from_bytes(dtbf.read(4), 'big')
-        if not dtb_check == 0xd00dfeed:
-            log.error(
-                f"error: compilation of '{source_dts_path}' did not produce a Device Tree Blob.")
+
+    if not needs_cpp:
+        # Nothing for the preprocessor to do: have dtc read the source directly.
+        res = subprocess.run(DTC_CMD + ["-o", target_dtb_path, source_dts_path], check=False,
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        if res.returncode != 0:
+            log.error(res.stdout.strip())
             return False
+    elif not _run_cpp_dtc(source_dts_path, include_dirs, target_dtb_path):
+        return False
+
+    if not is_dtb(target_dtb_path):
+        log.error(
+            f"error: compilation of '{source_dts_path}' did not produce a Device Tree Blob.")
+        return False
     log.info(f"'{os.path.basename(source_dts_path)}' compiles successfully.")
     return True
+
+
+def _run_cpp_dtc(source_dts_path, include_dirs, target_dtb_path):
+    '''Run "cpp | dtc" on 'source_dts_path'; returns True on success.'''
+    cpp_cmd = CPP_CMD + list(_cpp_include_flags(tuple(include_dirs))) + [source_dts_path]
+    dtc_cmd = DTC_CMD + ["-o", target_dtb_path]
+
+    # Run "cpp | dtc" without a shell; cpp's errors go to a temporary file so
+    # that a full stderr pipe can never stall the pipeline.
+    with tempfile.TemporaryFile(mode="w+") as cpp_errors:
+        # pylint: disable=consider-using-with
+        cpp_proc = subprocess.Popen(cpp_cmd, stdout=subprocess.PIPE, stderr=cpp_errors)
+        dtc_proc = subprocess.Popen(dtc_cmd, stdin=cpp_proc.stdout, stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT, text=True)
+        # pylint: enable=consider-using-with
+        cpp_proc.stdout.close()
+        dtc_output, _ = dtc_proc.communicate()
+        cpp_status = cpp_proc.wait()
+        if cpp_status != 0 or dtc_proc.returncode != 0:
+            cpp_errors.seek(0)
+            log.error((cpp_errors.read() + dtc_output).strip())
+            return False
+    return True
@@ -1,5 +1,7 @@
 """Backend implementation of dto subcommand."""
 
+import functools
+import glob
 import logging
 import os
 import subprocess
@@ -8,6 +10,23 @@ from tcbuilder.backend import dt
 
 log = logging.getLogger("torizon." + __name__)
 
+# Location of the device tree files of the kernel in the deployments of the base image,
+# relative to "ostree/deploy" (i.e. "<osname>/deploy/<deployment>/usr/lib/modules/<version>/dtb");
+# the depth is fixed so that the search never follows symlinks inside the deployments.
+BASE_DTB_DIR_GLOB = os.path.join("*", "deploy", "*", "usr", "lib", "modules", "*", "dtb")
+
+
+def _glob_base_image(storage_dir, pattern):
+    """Iterate over the files of the base image deployments matching 'pattern'.
+
+    'pattern' is relative to the kernel device tree directory; paths are produced
+    lazily, in directory order, so the search stops as soon as the caller does.
+    """
+    deploy_dir = glob.escape(os.path.join(storage_dir, "sysroot", "ostree", "deploy"))
+    for path in glob.iglob(os.path.join(deploy_dir, BASE_DTB_DIR_GLOB, pattern)):
+        if os.path.isfile(path):
+            yield path
+
 
 def get_active_overlays_txt_path(storage_dir):
     """Query the path to the currently applied overlays.txt.
@@ -21,15 +40,14 @@ def get_active_overlays_txt_path(storage_dir):
     if os.path.exists(path):
         # There is a recently applied (but not yet deployed) overlays.txt.
         return path
-    path = subprocess.check_output(
-        ["find", os.path.join(storage_dir, 'sysroot', 'ostree', 'deploy'),
-         "-type", "f", "-wholename", "*/usr/lib/modules/*/dtb/overlays.txt",
-         "-print", "-quit"], text=True).strip()
-    if path:
-        # The base image has an overlay definition.
-        return path
-    # No overlay definitions found.
-    return None
+    # The base image has an overlay definition, or no overlay definitions are found at all.
+    return _get_base_overlays_txt_path(os.path.abspath(storage_dir))
+
+
+# The base image does not change during a run, so the search (even a fruitless one) is cached.
+@functools.lru_cache(maxsize=None)
+def _get_base_overlays_txt_path(storage_dir):
+    return next(_glob_base_image(storage_dir, "overlays.txt"), None)
 
 
 def get_applied_overlays_base_names(storage_dir):
@@ -42,6 +60,12 @@ def get_applied_overlays_base_names(storage_dir):
         "fdt_overlays", overlays_txt_path).split()
 
 
+def get_changes_overlays_dir(storage_dir):
+    """Get the directory holding the recently applied (not yet deployed) overlay blobs."""
+    return os.path.join(dt.get_dt_changes_dir(storage_dir),
+                        dt.get_dtb_kernel_subdir(storage_dir), "overlays")
+
+
 def find_path_to_overlay(storage_dir, basename):
     """Get the full path of the overlay blob file.
 
@@ -49,20 +73,14 @@ def find_path_to_overlay(storage_dir, basename):
     (or die trying).
     """
 
-    path = os.path.join(dt.get_dt_changes_dir(storage_dir),
-                        dt.get_dtb_kernel_subdir(storage_dir),
-                        "overlays", basename)
+    path = os.path.join(get_changes_overlays_dir(storage_dir), basename)
     if os.path.exists(path):
         # There is a recently applied (but not yet deployed) overlay blob with
         # this base name.
         return path
     # Resort to the overlay blobs of the base image.
-    path = subprocess.check_output(
-        ["find",
-         os.path.join(storage_dir, "sysroot/ostree/deploy"),
-         "-type", "f", "-wholename",
-         os.path.join("*/usr/lib/modules/*/dtb/overlays", basename),
-         "-print", "-quit"], text=True).strip()
+    path = next(_glob_base_image(storage_dir, os.path.join("overlays", glob.escape(basename))),
+                None)
     assert path, f"panic: no blob found for overlay {basename}!"
     return path
 
@@ -71,30 +89,57 @@ def get_applied_overlay_paths(storage_dir, base_names=None):
     """Query the paths to the currently applied overlays."""
     if base_names is None:
         base_names = get_applied_overlays_base_names(storage_dir)
-    return [find_path_to_overlay(storage_dir, basename) for basename in base_names]
-
+    if not base_names:
+        return []
 
-def modify_dtb_by_overlays(source_dtb_path, source_dtob_paths, target_dtb_path):
+    # Resolve the locations once for all overlays: list the recently applied blobs
+    # and index the blobs of the base image instead of probing for every overlay.
+    changes_overlays_dir = get_changes_overlays_dir(storage_dir)
+    try:
+        changed_overlays = set(os.listdir(changes_overlays_dir))
+    except FileNotFoundError:
+        changed_overlays = set()
+    base_overlays = {}
+    if not changed_overlays.issuperset(base_names):
+        for path in _glob_base_image(storage_dir, os.path.join("overlays", "*")):
+            base_overlays.setdefault(os.path.basename(path), path)
+
+    paths = []
+    for basename in base_names:
+        if basename in changed_overlays:
+            path = os.path.join(changes_overlays_dir, basename)
+        else:
+            path = base_overlays.get(basename)
+        assert path, f"panic: no blob found for overlay {basename}!"
+        paths.append(path)
+    return paths
+
+
+def modify_dtb_by_overlays(source_dtb_path, source_dtob_paths, target_dtb_path,
+                           report_errors=True):
     """Apply overlay blobs over device tree blob.
 
     Apply the device tree overlay blobs 'dtob_paths' over the device tree blob
     'source_dtb_path', producing the device tree blob 'target_dtb_path'.
+    With 'report_errors' False a failing application is only logged at debug level.
 
     Returns True on successful application, False otherwise.
     """
 
     assert source_dtob_paths, "panic: empty list of overlays!"
-    res = subprocess.run([
-        "fdtoverlay", "-i", source_dtb_path, "-o", target_dtb_path
-    ] + source_dtob_paths, check=False, capture_output=True, text=True)
+    fdtoverlay_cmd = ["fdtoverlay", "-i", source_dtb_path, "-o", target_dtb_path]
+    # Only the diagnostics are of interest, and only when the application fails.
+    res = subprocess.run(fdtoverlay_cmd + source_dtob_paths, check=False,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if res.returncode != 0 and not report_errors:
+        log.debug(res.stderr)
+        return False
     if res.returncode != 0:
         log.error(res.stderr)
         log.error(f"error: cannot apply device tree overlays {source_dtob_paths} "
                   f"against device tree {source_dtb_path}.")
         return False
-    dtb_check = subprocess.check_output(["file", target_dtb_path], text=True).strip()
-    log.info(dtb_check)
-    if not "Device Tree Blob" in dtb_check:
+    if not dt.is_dtb(target_dtb_path):
         log.error(
             f"error: application of overlays {source_dtob_paths} against "
             f"device tree {source_dtb_path} did not produce a device tree blob.")
@@ -4,7 +4,12 @@ Backend handling for build subcommand
 
 import base64
 import binascii
+import errno
+import functools
+import hashlib
+import http
 import http.server
+import io
 import json
 import logging
 import os
@@ -13,19 +18,23 @@ import shlex
 import shutil
 import subprocess
 import sys
+import tarfile
 import tempfile
-import urllib.request
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from zipfile import ZipFile
-from tempfile import TemporaryDirectory
 
 import guestfs
 import paramiko
+import requests
 
 from tcbuilder.backend.common import (get_rootfs_tarball, get_tar_compress_program_options,
                                       set_output_ownership, run_with_loading_animation,
-                                      get_tezi_image_version, DEFAULT_RAW_ROOTFS_LABEL,
-                                      RAW_PROP_TO_ARGNAME)
+                                      get_tezi_image_version, clone_tree,
+                                      get_unpack_command, get_parallel_unpack_command,
+                                      get_file_sha256sum,
+                                      DEFAULT_RAW_ROOTFS_LABEL, RAW_PROP_TO_ARGNAME)
 from tcbuilder.backend import ostree
 from tcbuilder.errors import (TorizonCoreBuilderError, InvalidArgumentError, InvalidStateError)
 from tezi.image import ImageConfig, DEFAULT_IMAGE_JSON_FILENAME
@@ -43,11 +52,131 @@ VERSION_TO_YOCTO_MAP = {
     "scarthgap": "scarthgap-7.x.y"
 }
 
+# The PRETTY_NAME line of a device's os-release, and its fields used to locate its Tezi image.
+PRETTY_NAME_REGEX = re.compile(r'^PRETTY_NAME=.*$', re.MULTILINE)
+VERSION_DATE_REGEX = re.compile(r'.*-(.*?)\+')
+VERSION_BUILD_REGEX = re.compile(r'.*build.(.*?)\ ')
+VERSION_SEMVER_REGEX = re.compile(r'.*([0-9]+\.[0-9]+\.[0-9]+)\.*')
+VERSION_YOCTO_REGEX = re.compile("|".join(map(re.escape, VERSION_TO_YOCTO_MAP)))
+# Markers of the devel, upstream-kernel and real-time image variants, found in a single scan.
+VERSION_FLAGS_REGEX = re.compile(r'devel|Upstream|PREEMPT')
+
 LAST_DEPRECATED_IMAGE_MAJOR = 5
 LAST_DEPRECATED_IMAGE_NAME = "TorizonCore"
 LAST_DEPRECATED_IMAGE_VERSION = "5.7.2"
 LAST_TCB_VERSION_SUPPORTING_DEPRECATED = "3.10.0"
 
+AVAHI_PID_FILE = "/run/avahi-daemon/pid"
+# Seconds to wait for the Avahi daemon started by serve() to exit before killing it.
+AVAHI_STOP_TIMEOUT = 5
+
+# Value of ZipInfo.create_system for members archived on Unix (whose external_attr holds
+# the file mode in its upper 16 bits).
+ZIP_UNIX_SYSTEM = 3
+
+# Size of the blocks in which images are downloaded or extracted and written to disk.
+IMAGE_IO_BLOCK_SIZE = 1024 * 1024
+
+# Timeouts, in seconds, to connect to the download server and to wait for data from it.
+DOWNLOAD_TIMEOUT = (30, 60)
+
+# Downloads are split into this many parallel range requests when the environment
+# variable below is set to 1.
+DOWNLOAD_PARTS = 4
+PARALLEL_DOWNLOAD_ENV_VAR = "TCB_PARALLEL_DOWNLOAD"
+
+# Interval, in seconds, of the keepalive messages of the SSH connections to devices.
+SSH_KEEPALIVE_INTERVAL = 30
+
+# SSH connections to devices opened by get_ssh_client(): (host, username, port) -> client.
+_ssh_clients = {}
+
+# Shell command printing, in sections, what get_device_info() needs to know about a device.
+DEVICE_INFO_SEPARATOR = "---"
+DEVICE_INFO_COMMAND = (
+    f"grep ^PRETTY_NAME= /etc/os-release; echo {DEVICE_INFO_SEPARATOR}; "
+    f"cat /etc/hostname; echo {DEVICE_INFO_SEPARATOR}; "
+    "if [ -e /usr/bin/podman ]; then echo podman; else echo docker; fi")
+
+
+def avahi_daemon_running():
+    """Check whether the Avahi daemon is running, based on its PID file."""
+    try:
+        with open(AVAHI_PID_FILE, "r") as pid_file:
+            pid = int(pid_file.read().strip())
+        # Signal 0 only checks that the process exists.
+        os.kill(pid, 0)
+    except PermissionError:
+        # The process exists, it is just not ours.
+        return True
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+class TeziImagesRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Handler for the HTTP server of the 'images serve' command."""
+
+    # Keep connections open: Tezi fetches the files of an image one after the other.
+    protocol_version = "HTTP/1.1"
+
+    # Contents of the JSON files served so far, along with their modification
+    # times and entity tags: path -> (st_mtime_ns, data, etag).
+    json_cache = {}
+
+    def log_message(self, *args):
+        path = args[1]
+        code = "OK" if args[2] == "200" else "Error"
+        log.debug(f"{path} {code}")
+
+    def do_GET(self):
+        """
+        Insert a 'Cache-Control' HTTP header in each response for
+        every '*.json' file requested previously so Toradex Easy
+        Installer will ask again for JSON files which it could
+        had already been asked in the pass because of multiple
+        executions of the TorizonCore Builder 'serve' command.
+        """
+        if self.path.endswith('.json'):
+            # Tezi polls the JSON files repeatedly: read them again only when changed.
+            json_path = self.translate_path(self.path)
+            try:
+                mtime = os.stat(json_path).st_mtime_ns
+                cached = self.json_cache.get(json_path)
+                if cached is None or cached[0] != mtime:
+                    with open(json_path, "rb") as json_file:
+                        data = json_file.read()
+                    cached = (mtime, data, f'"{mtime:x}-{len(data):x}"')
+                    self.json_cache[json_path] = cached
+            except OSError:
+                self.send_error(http.HTTPStatus.NOT_FOUND, "File not found")
+                return
+            _, data_json, etag = cached
+            if self.headers.get("If-None-Match") == etag:
+                # The client already has this very version of the file.
+                self.send_response(http.HTTPStatus.NOT_MODIFIED)
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", "no-store,max-age=0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data_json)))
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-store,max-age=0")
+            self.end_headers()
+            self.wfile.write(data_json)
+        else:
+            super().do_GET()
+
+    def copyfile(self, source, outputfile):
+        """Send the (possibly huge) image files with sendfile(), without copying them here."""
+        if outputfile is self.wfile:
+            self.connection.sendfile(source)
+        else:
+            super().copyfile(source, outputfile)
+
+
 def serve(images_directory):
     """
     Serve TorizonCore TEZI images via HTTP so they can be installed directly
@@ -62,55 +191,66 @@ def serve(images_directory):
                       f"does not exist inside '{images_directory}' directory.")
         sys.exit(1)
 
-    class Handler(http.server.SimpleHTTPRequestHandler):
-        """Handler for the HTTP server."""
-
-        def __init__(self, *args, **kwargs):
-            super().__init__(*args, directory=images_directory, **kwargs)
-
-        def log_message(self, *args):
-            path = args[1]
-            code = "OK" if args[2] == "200" else "Error"
-            log.debug(f"{path} {code}")
-
-        def do_GET(self):
-            """
-            Insert a 'Cache-Control' HTTP header in each response for
-            every '*.json' file requested previously so Toradex Easy
-            Installer will ask again for JSON files which it could
-            had already been asked in the pass because of multiple
-            executions of the TorizonCore Builder 'serve' command.
-            """
-            if self.path.endswith('.json'):
-                fd_json = open(os.path.join(images_directory, self.path[1:])).read()
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.send_header("Content-Length", str(len(fd_json)))
-                self.send_header("Cache-Control", "no-store,max-age=0")
-                self.end_headers()
-                self.wfile.write(fd_json.encode("utf-8"))
-            else:
-                super().do_GET()
-
+    avahi = None
     try:
-        # The Avahi deamon should respond for zeroconf TEZI services
-        avahi = subprocess.Popen(["avahi-daemon"],
-                                 stdin=subprocess.DEVNULL,
-                                 stdout=subprocess.DEVNULL,
-                                 stderr=subprocess.DEVNULL)
+        # The Avahi deamon should respond for zeroconf TEZI services; there is no
+        # need to start (and later stop) it when it is already running.
+        if avahi_daemon_running():
+            log.debug("Avahi daemon is already running.")
+        else:
+            avahi = subprocess.Popen(["avahi-daemon"],
+                                     stdin=subprocess.DEVNULL,
+                                     stdout=subprocess.DEVNULL,
+                                     stderr=subprocess.DEVNULL)
 
         # Serve TEZI images directory via HTTP
         log.info("Currently serving Toradex Easy Installer images from "
                  f"'{images_directory}'. You may now run Toradex Easy Installer "
                  "on your Toradex Device and install these images. Press "
                  "'Ctrl+C' to quit and stop serving these images.\n")
-        with http.server.ThreadingHTTPServer(("", 80), Handler) as httpd:
+        handler = functools.partial(TeziImagesRequestHandler, directory=images_directory)
+        with http.server.ThreadingHTTPServer(("", 80), handler) as httpd:
             httpd.serve_forever()
     except KeyboardInterrupt:
         pass
     finally:
-        avahi.terminate()
-        avahi.wait()
+        if avahi is not None and avahi.poll() is None:
+            avahi.terminate()
+            try:
+                avahi.wait(timeout=AVAHI_STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                log.debug("Avahi daemon did not stop in time: killing it.")
+                avahi.kill()
+                avahi.wait()
+
+
+def get_ssh_client(r_host, r_username, r_password, r_port):
+    """
+    Get an SSH connection to a device, reusing a previous one while it is alive.
+
+    The key exchange and authentication of a new connection take much longer
+    than running a command over an existing one, so connections are kept open
+    (with keepalives) for the rest of the run.
+    """
+
+    key = (r_host, r_username, r_port)
+    client = _ssh_clients.get(key)
+    if client is not None:
+        transport = client.get_transport()
+        if transport is not None and transport.is_active():
+            return client
+        client.close()
+
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+    client.connect(hostname=r_host,
+                   username=r_username,
+                   password=r_password,
+                   port=r_port)
+    client.get_transport().set_keepalive(SSH_KEEPALIVE_INTERVAL)
+    _ssh_clients[key] = client
+    return client
 
 
 def get_device_info(r_host, r_username, r_password, r_port):
@@ -126,38 +266,159 @@ def get_device_info(r_host, r_username, r_password, r_port):
         container: Container runtime engine.
     """
 
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client = get_ssh_client(r_host, r_username, r_password, r_port)
 
-    client.connect(hostname=r_host,
-                   username=r_username,
-                   password=r_password,
-                   port=r_port)
+    # Gather module and version information remotely from device, in a single round trip.
+    stdout = client.exec_command(DEVICE_INFO_COMMAND)[1]
+    output = stdout.read().decode(errors="replace")
+    status = stdout.channel.recv_exit_status()
 
-    # Gather module and version information remotely from device
-    sftp = client.open_sftp()
-    if sftp is not None:
-        release_file = sftp.file("/etc/os-release")
-        for line in release_file:
-            if "PRETTY_NAME" in line:
-                version = line
-        host_file = sftp.file("/etc/hostname")
-        hostname = host_file.readline()
-        try:
-            sftp.stat("/usr/bin/podman")
-            container = "podman"
-        except IOError:
-            container = "docker"
-        sftp.close()
-    else:
-        client.close()
-        raise TorizonCoreBuilderError("Unable to create SSH connection")
+    sections = output.split(DEVICE_INFO_SEPARATOR + "\n")
+    if status != 0 or len(sections) != 3:
+        raise TorizonCoreBuilderError("Unable to get information from the device")
+    release, host, container = sections
 
-    client.close()
+    version_match = PRETTY_NAME_REGEX.search(release)
+    if version_match is None:
+        raise TorizonCoreBuilderError("Unable to get the TorizonCore version of the device")
+    version = version_match.group(0)
+    hostname = host.splitlines(keepends=True)[0] if host else ""
+    container = container.strip()
 
     return version, hostname, container
 
 
+def download_artifact(url, target_path, tee=None):
+    """
+    Download a file from the Toradex Artifactory, streaming it to disk.
+
+    The data is hashed while it is written and, when the server publishes the
+    SHA-256 checksum of the file (X-Checksum-Sha256 header), checked against it.
+    With TCB_PARALLEL_DOWNLOAD=1 in the environment (and no 'tee') the file is
+    fetched as DOWNLOAD_PARTS byte ranges in parallel, if the server supports that.
+
+    :param url: URL of the file.
+    :param target_path: Path of the file to be written.
+    :param tee: If specified, a binary file object to which the data is also
+                written, in order, as it arrives (no parallel download then).
+    """
+
+    try:
+        head = None
+        if tee is None and os.environ.get(PARALLEL_DOWNLOAD_ENV_VAR) == "1":
+            head = requests.head(url, allow_redirects=True, timeout=DOWNLOAD_TIMEOUT)
+            head.raise_for_status()
+        if (head is not None and head.headers.get("Accept-Ranges") == "bytes" and
+                "Content-Length" in head.headers):
+            expected_sha256 = head.headers.get("X-Checksum-Sha256")
+            _download_in_parts(head.url, target_path, int(head.headers["Content-Length"]))
+            actual_sha256 = get_file_sha256sum(target_path)
+        else:
+            with requests.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as res:
+                res.raise_for_status()
+                expected_sha256 = res.headers.get("X-Checksum-Sha256")
+                sha256 = hashlib.sha256()
+                with open(target_path, "wb") as target_file:
+                    for chunk in res.iter_content(chunk_size=IMAGE_IO_BLOCK_SIZE):
+                        target_file.write(chunk)
+                        if tee is not None:
+                            tee.write(chunk)
+                        sha256.update(chunk)
+            actual_sha256 = sha256.hexdigest()
+    except requests.RequestException as exc:
+        raise TorizonCoreBuilderError("The requested image could not be found "
+                                      "in the Toradex Artifactory.") from exc
+
+    if expected_sha256 and actual_sha256 != expected_sha256.lower():
+        os.unlink(target_path)
+        raise TorizonCoreBuilderError(
+            f"Downloaded file '{os.path.basename(target_path)}' has wrong sha256 checksum "
+            f"(actual='{actual_sha256}', expected='{expected_sha256}')")
+
+
+def _download_in_parts(url, target_path, size):
+    """Download the 'size' bytes of 'url' as parallel range requests into 'target_path'."""
+
+    part_size = max(1, -(-size // DOWNLOAD_PARTS))
+    target_fd = os.open(target_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+    def download_part(start):
+        end = min(start + part_size, size) - 1
+        with requests.get(url, headers={"Range": f"bytes={start}-{end}"}, stream=True,
+                          timeout=DOWNLOAD_TIMEOUT) as res:
+            res.raise_for_status()
+            if res.status_code != http.HTTPStatus.PARTIAL_CONTENT:
+                raise requests.RequestException(f"Range request not honored for {url}")
+            offset = start
+            # Each part is written straight to its final place in the file.
+            for chunk in res.iter_content(chunk_size=IMAGE_IO_BLOCK_SIZE):
+                view = memoryview(chunk)
+                while view:
+                    written = os.pwrite(target_fd, view, offset)
+                    view = view[written:]
+                    offset += written
+        if offset != end + 1:
+            raise requests.RequestException(f"Incomplete range {start}-{end} from {url}")
+
+    try:
+        try:
+            os.posix_fallocate(target_fd, 0, size)
+        except OSError:
+            # Not supported by the filesystem: just set the final size.
+            os.ftruncate(target_fd, size)
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_PARTS) as executor:
+            list(executor.map(download_part, range(0, size, part_size)))
+    finally:
+        os.close(target_fd)
+
+
+def _download_and_extract(url, target_path, extract_dir):
+    """Download tarball 'url' into 'target_path' while extracting it into 'extract_dir'.
+
+    The data is piped into tar as it arrives, so the image is unpacked while it is
+    still being downloaded instead of being read back from disk afterwards. tar cannot
+    detect the compression of its standard input, so the decompressor is chosen from
+    the file name, as in import_local_image(). On failure the partial download is removed.
+    """
+
+    tarcmd = [
+        "tar",
+        "-xf", "-",
+        "-C", extract_dir,
+    ] + get_tar_compress_program_options(target_path)
+    log.debug(f"Running tar command: {shlex.join(tarcmd)}")
+    # tar's errors go to a temporary file, so that a full stderr pipe can never stall it.
+    with tempfile.TemporaryFile(mode="w+") as tar_errors:
+        # pylint: disable=consider-using-with
+        proc = subprocess.Popen(tarcmd, stdin=subprocess.PIPE, stderr=tar_errors)
+        # pylint: enable=consider-using-with
+        try:
+            try:
+                download_artifact(url, target_path, tee=proc.stdin)
+            finally:
+                proc.stdin.close()
+        except BrokenPipeError:
+            # tar exited early: its error is reported below.
+            pass
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            _remove_partial_download(target_path)
+            raise
+        if proc.wait() != 0:
+            _remove_partial_download(target_path)
+            tar_errors.seek(0)
+            raise TorizonCoreBuilderError(
+                f"Unable to unpack the downloaded image: {tar_errors.read().strip()}")
+
+
+def _remove_partial_download(target_path):
+    """Remove file 'target_path' left by a failed download, if present."""
+
+    if os.path.exists(target_path):
+        os.unlink(target_path)
+
+
 # pylint: disable=too-many-locals
 def download_tezi(r_host, r_username, r_password, r_port,
                   tezi_dir, src_sysroot_dir, src_ostree_archive_dir):
@@ -171,49 +432,47 @@ def download_tezi(r_host, r_username, r_password, r_port,
                                                    r_port)
 
     # Create correct artifactory link based on device information
-    if "devel" in version:
+    version_flags = set(VERSION_FLAGS_REGEX.findall(version))
+    if "devel" in version_flags:
         prod = "torizoncore-oe-prerelease-frankfurt"
         devel = "-devel-"
     else:
         prod = "torizoncore-oe-prod-frankfurt"
         devel = ""
 
-    for key in VERSION_TO_YOCTO_MAP:
-        if key in version:
-            if key in ("dunfell", "kirkstone"):
-                yocto_img_name = "torizon-core"
-            else:
-                yocto_img_name = "torizon"
-
-            yocto = VERSION_TO_YOCTO_MAP[key]
-            break
+    yocto_match = VERSION_YOCTO_REGEX.search(version)
+    assert yocto_match, "Missing the Yocto reference"
+    key = yocto_match.group(0)
+    if key in ("dunfell", "kirkstone"):
+        yocto_img_name = "torizon-core"
     else:
-        assert False, "Missing the Yocto reference"
-
-    date = re.findall(r'.*-(.*?)\+', version)
-    if not date:
+        yocto_img_name = "torizon"
+    yocto = VERSION_TO_YOCTO_MAP[key]
+
+    # Each pattern has a single match at most (its greedy prefix takes the last candidate),
+    # so a search suffices.
+    date_match = VERSION_DATE_REGEX.search(version)
+    date = date_match.group(1) if date_match else ""
+    if not date_match:
         build_type = "release"
-        date = ""
-    elif len(date[0]) == 6:
+    elif len(date) == 6:
         build_type = "monthly"
-        date = date[0]
-    elif len(date[0]) == 8:
+    elif len(date) == 8:
         build_type = "nightly"
-        date = date[0]
 
-    build_number = re.findall(r'.*build.(.*?)\ ', version)[0]
+    build_number = VERSION_BUILD_REGEX.search(version).group(1)
 
-    if "Upstream" in version:
+    if "Upstream" in version_flags:
         kernel_type = "-upstream"
     else:
         kernel_type = ""
 
-    if "PREEMPT" in version:
+    if "PREEMPT" in version_flags:
         rt_flag = "-rt"
     else:
         rt_flag = ""
 
-    sem_ver = re.findall(r'.*([0-9]+\.[0-9]+\.[0-9]+)\.*', version)[0]
+    sem_ver = VERSION_SEMVER_REGEX.search(version).group(1)
 
     module_name = hostname[:-10]
 
@@ -223,26 +482,38 @@ def download_tezi(r_host, r_username, r_password, r_port,
               prod, yocto, build_type, build_number, module_name, kernel_type,
               rt_flag, yocto_img_name, container, sem_ver, devel, date)
 
-    # Download and unpack tezi image
     log.info(f"Downloading image from: {url}\n")
     log.info("The download may take some time. Please wait...")
     download_file = os.path.basename(url)
     download_file_cwd = os.path.abspath(download_file)
-    try:
-        urllib.request.urlretrieve(url, download_file_cwd)
+    if os.environ.get(PARALLEL_DOWNLOAD_ENV_VAR) == "1":
+        # The byte ranges arrive out of order and cannot be piped into tar: download
+        # the whole tarball first and unpack it afterwards.
+        download_artifact(url, download_file_cwd)
         log.info("Download Complete!\n")
-    except:
-        raise TorizonCoreBuilderError("The requested image could not be found "
-                                      "in the Toradex Artifactory.")
+        set_output_ownership(download_file_cwd)
+        import_local_image(download_file_cwd, tezi_dir,
+                           src_sysroot_dir, src_ostree_archive_dir)
+        return
+
+    # Download and unpack tezi image, both at once; as in import_local_image(), the
+    # image is extracted next to tezi_dir so that it can be moved there with a rename.
+    os.mkdir(src_sysroot_dir)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(tezi_dir))) as tempdir:
+        _download_and_extract(url, download_file_cwd, tempdir)
+        log.info("Download Complete!\n")
+        _move_extracted_image(tempdir, tezi_dir)
     set_output_ownership(download_file_cwd)
-    import_local_image(download_file, tezi_dir,
-                       src_sysroot_dir, src_ostree_archive_dir)
+
+    log.info("Unpacking TorizonCore Toradex Easy Installer image.")
+    unpack_local_image(tezi_dir, src_sysroot_dir)
+    _import_sysroot(src_sysroot_dir, src_ostree_archive_dir, tezi_dir)
 # pylint: enable=too-many-locals
 
 
 def unpack_local_image(image_dir, sysroot_dir):
     """Extract the root fs tarball from the image into the sysroot directory"""
-    tarfile = get_rootfs_tarball(image_dir)
+    rootfs_tarball = get_rootfs_tarball(image_dir)
 
     # pylint: disable=line-too-long
     # This is a OSTree bare repository. Care must been taken to preserve all
@@ -253,14 +524,14 @@ def unpack_local_image(image_dir, sysroot_dir):
     tarcmd = [
         "tar",
         "--xattrs", "--xattrs-include=*",
-        "-xhf", tarfile,
+        "-xhf", rootfs_tarball,
         "-C", sysroot_dir,
-    ] + get_tar_compress_program_options(tarfile)
+    ] + get_tar_compress_program_options(rootfs_tarball)
     log.debug(f"Running tar command: {shlex.join(tarcmd)}")
     subprocess.check_output(tarcmd, stderr=subprocess.STDOUT)
 
     # Remove the tarball since we have it unpacked now
-    os.unlink(tarfile)
+    os.unlink(rootfs_tarball)
 
 
 def unpack_local_raw_image(image_dir, sysroot_dir, raw_rootfs_label):
@@ -302,13 +573,58 @@ def unpack_local_raw_image(image_dir, sysroot_dir, raw_rootfs_label):
         raise TorizonCoreBuilderError(f"guestfs: {str(gfserr)}")
 
 
-def _make_tezi_extract_dir(tezi_dir):
-    """Create target directory where to extract the tezi image"""
-    extract_dir = tezi_dir + '.tmp'
-    if os.path.exists(extract_dir):
-        shutil.rmtree(extract_dir)
-    os.mkdir(extract_dir)
-    return extract_dir
+def _extract_zip(zip_path, extract_dir):
+    """Extract ZIP file 'zip_path' into 'extract_dir', writing its members in large blocks."""
+    extract_dir = os.path.realpath(extract_dir)
+    with ZipFile(zip_path, 'r') as zip_file:
+        for info in zip_file.infolist():
+            target = os.path.realpath(os.path.join(extract_dir, info.filename))
+            if os.path.commonpath([extract_dir, target]) != extract_dir:
+                raise TorizonCoreBuilderError(
+                    f"Refusing to extract '{info.filename}' outside of the image directory.")
+            if info.is_dir():
+                os.makedirs(target, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with zip_file.open(info) as src, \
+                 open(target, "wb", buffering=IMAGE_IO_BLOCK_SIZE) as dst:
+                shutil.copyfileobj(src, dst, IMAGE_IO_BLOCK_SIZE)
+            # Keep the permission bits of members archived on Unix.
+            mode = (info.external_attr >> 16) & 0o777
+            if info.create_system == ZIP_UNIX_SYSTEM and mode:
+                os.chmod(target, mode)
+
+
+def _move_image_dir(src_dir, dst_dir):
+    """Move directory 'src_dir' to 'dst_dir', with a single rename when possible.
+
+    shutil.move() silently falls back to copying the whole tree when the
+    directories are in different filesystems; that case is reported here.
+    """
+    if os.path.exists(dst_dir):
+        shutil.move(src_dir, dst_dir)
+        return
+    try:
+        os.rename(src_dir, dst_dir)
+    except OSError as exc:
+        if exc.errno != errno.EXDEV:
+            raise
+        log.warning(f"'{src_dir}' and '{dst_dir}' are in different filesystems: "
+                    "the image will be copied.")
+        shutil.move(src_dir, dst_dir)
+
+
+def _move_extracted_image(extract_dir, tezi_dir):
+    """Move the Tezi image extracted into 'extract_dir' to 'tezi_dir'.
+
+    The image is either the single directory in 'extract_dir' or 'extract_dir' itself.
+    """
+    contents = os.listdir(extract_dir)
+    if len(contents) == 1 and os.path.isdir(os.path.join(extract_dir, contents[0])):
+        image_dir = os.path.join(extract_dir, contents[0])
+    else:
+        image_dir = extract_dir
+    _move_image_dir(image_dir, tezi_dir)
 
 
 # pylint: disable=too-many-locals
@@ -329,7 +645,7 @@ def import_local_image(image_dir_or_file, tezi_dir, src_sysroot_dir, src_ostree_
         if os.path.isfile(image_dir_or_file):
             # This creates tempdir next to tezi_dir to ensure moving files
             # can be efficiently done with a single rename syscall by
-            # shutil.move later.
+            # _move_image_dir() later.
             with tempfile.TemporaryDirectory(dir=os.path.dirname(tezi_dir)) as tempdir:
                 tar_compress_options = get_tar_compress_program_options(image_dir_or_file)
 
@@ -344,22 +660,17 @@ def import_local_image(image_dir_or_file, tezi_dir, src_sysroot_dir, src_ostree_
                     subprocess.check_output(tarcmd, stderr=subprocess.STDOUT)
                 elif image_dir_or_file.endswith(".zip"):
                     log.info("Unzipping Toradex Easy Installer image.")
-                    with ZipFile(image_dir_or_file, 'r') as file:
-                        file.extractall(tempdir)
+                    _extract_zip(image_dir_or_file, tempdir)
                 else:
                     raise TorizonCoreBuilderError(
                         f"Unsupported image file type: {image_dir_or_file}")
 
-                contents = os.listdir(tempdir)
-                if len(contents) == 1 and os.path.isdir(os.path.join(tempdir, contents[0])):
-                    shutil.move(os.path.join(tempdir, contents[0]), tezi_dir)
-                else:
-                    shutil.move(tempdir, tezi_dir)
+                _move_extracted_image(tempdir, tezi_dir)
 
         elif os.path.isdir(image_dir_or_file):
             log.info("Copying Toradex Easy Installer image.")
             log.debug(f"Copy directory {image_dir_or_file} -> {tezi_dir}.")
-            shutil.copytree(image_dir_or_file, tezi_dir)
+            clone_tree(image_dir_or_file, tezi_dir)
         elif os.path.exists(image_dir_or_file):
             raise TorizonCoreBuilderError(f"Image is not a file or directory: {image_dir_or_file}")
         else:
@@ -376,6 +687,13 @@ def import_local_image(image_dir_or_file, tezi_dir, src_sysroot_dir, src_ostree_
         log.info("Unpacking TorizonCore Toradex Easy Installer image.")
         unpack_local_image(tezi_dir, src_sysroot_dir)
 
+    _import_sysroot(src_sysroot_dir, src_ostree_archive_dir, tezi_dir)
+# pylint: enable=too-many-locals
+
+
+def _import_sysroot(src_sysroot_dir, src_ostree_archive_dir, tezi_dir):
+    """Import the deployed OSTree commit of the unpacked image into the OSTree archive."""
+
     src_sysroot = ostree.load_sysroot(src_sysroot_dir)
     csum, _ = ostree.get_deployment_info_from_sysroot(src_sysroot)
 
@@ -407,7 +725,6 @@ def import_local_image(image_dir_or_file, tezi_dir, src_sysroot_dir, src_ostree_
                         "for this use case. Proceed at your own risk.")
         else:
             log.warning("Warning: Unsupported image version detected. Proceed at your own risk.")
-# pylint: enable=too-many-locals
 
 
 def prov_check_provdata_presence(input_dir):
@@ -428,56 +745,125 @@ def prov_gen_provdata_tarball(output_dir, shared_data, online_data, hibernated):
     operation is not in-place).
     """
 
+    online_data_json = None
+    if online_data:
+        # Try to decode it just to be sure it is actually valid JSON.
+        try:
+            online_data_json = base64.b64decode(online_data + "=" * (-len(online_data) % 4))
+            online_data_obj = json.loads(online_data_json)
+
+            # Add 'hibernated' key if user enabled hibernated mode
+            if hibernated and isinstance(online_data_obj, dict):
+                log.info("Adding hibernated mode flag.")
+                online_data_obj['hibernated'] = True
+                online_data_json = json.dumps(online_data_obj).encode("utf-8")
+
+        except (binascii.Error, json.decoder.JSONDecodeError) as exc:
+            raise TorizonCoreBuilderError(
+                "Failure decoding online data: aborting.") from exc
+
     # Let us create the contents of the /var/sota/ directory:
     # - auto-provisioning.json
     # - import/
     #   - directory contents taken from the shared data tarball
     #
-    with TemporaryDirectory() as tmpdir:
-        toplvl_entries = []
-        log.debug(f"Writing provisioning files to directory: {tmpdir}")
-
-        # Create import directory and extract original shared data into it. This
-        # will keep the numeric IDs and attributes of files since we are running
-        # inside a container (i.e. as root from the perspective of "tar").
-        import_dir = os.path.join(tmpdir, PROV_IMPORT_DIRNAME)
-        os.mkdir(import_dir, 0o511)
-        subprocess.check_output(["tar", "-xvf", shared_data, "-C", import_dir])
-        toplvl_entries.append(PROV_IMPORT_DIRNAME)
-
-        # Create the file holding online provisioning data:
-        if online_data:
-            online_prov_file = os.path.join(tmpdir, PROV_ONLINE_DATA_FILENAME)
-            with open(online_prov_file, "wb") as outfile:
-                # Try to decode it just to be sure it is actually valid JSON.
-                try:
-                    online_data_padded = online_data
-                    online_data_padded += "=" * ((4 - len(online_data) % 4) %4)
-                    online_data_json = base64.b64decode(online_data_padded)
-                    online_data_obj = json.loads(online_data_json)
-
-                    # Add 'hibernated' key if user enabled hibernated mode
-                    if hibernated and isinstance(online_data_obj, dict):
-                        log.info("Adding hibernated mode flag.")
-                        online_data_obj['hibernated'] = True
-                        online_data_json = json.dumps(online_data_obj).encode("utf-8")
-
-                except (binascii.Error, json.decoder.JSONDecodeError) as exc:
-                    raise TorizonCoreBuilderError(
-                        "Failure decoding online data: aborting.") from exc
-                outfile.write(online_data_json)
+    # The entries of the shared data tarball are copied straight into the output tarball,
+    # under import/, keeping their numeric IDs and attributes; nothing goes through disk.
+    tarball_path = os.path.join(output_dir, PROV_DATA_FILENAME)
+    try:
+        with open(tarball_path, "wb") as tarball_file:
+            # Compress with all cores when pigz is available.
+            if shutil.which("pigz"):
+                with subprocess.Popen(["pigz", "-c"], stdin=subprocess.PIPE,
+                                      stdout=tarball_file) as pigz_proc:
+                    with tarfile.open(fileobj=pigz_proc.stdin, mode="w|",
+                                      format=tarfile.GNU_FORMAT) as out_tar:
+                        _write_provdata_entries(out_tar, shared_data, online_data_json)
+                if pigz_proc.returncode != 0:
+                    raise TorizonCoreBuilderError("Failure compressing the provisioning data.")
+            else:
+                with tarfile.open(fileobj=tarball_file, mode="w|gz",
+                                  format=tarfile.GNU_FORMAT) as out_tar:
+                    _write_provdata_entries(out_tar, shared_data, online_data_json)
+    except BaseException:
+        if os.path.exists(tarball_path):
+            os.unlink(tarball_path)
+        raise
+
 
-            # Make file contents only visible to root user (assumed UID=0, GID=0).
-            os.chmod(online_prov_file, 0o640)
-            os.chown(online_prov_file, uid=0, gid=0)
+def _write_provdata_entries(out_tar, shared_data, online_data_json):
+    """Write the entries of the provisioning tarball into 'out_tar'."""
 
-            toplvl_entries.append(PROV_ONLINE_DATA_FILENAME)
+    unpack_cmd = get_unpack_command(shared_data)
+    try:
+        with open(shared_data, "rb") as shared_file:
+            if unpack_cmd == "cat":
+                # Unknown extension: let tarfile detect the compression, if any.
+                _copy_shared_data_entries(out_tar, shared_file, mode="r|*")
+            else:
+                # Decompress with the same tools used for the other tarballs.
+                with subprocess.Popen(shlex.split(get_parallel_unpack_command(unpack_cmd)),
+                                      stdin=shared_file,
+                                      stdout=subprocess.PIPE) as unpack_proc:
+                    _copy_shared_data_entries(out_tar, unpack_proc.stdout)
+                    # Drain whatever follows the end-of-archive marker.
+                    while unpack_proc.stdout.read(IMAGE_IO_BLOCK_SIZE):
+                        pass
+                if unpack_proc.returncode != 0:
+                    raise TorizonCoreBuilderError(
+                        f"Failure decompressing shared data tarball '{shared_data}'.")
+    except tarfile.TarError as exc:
+        raise TorizonCoreBuilderError(
+            f"Failure reading shared data tarball '{shared_data}': {exc}") from exc
+
+    # Create the file holding online provisioning data; its contents are only visible to
+    # the root user (assumed UID=0, GID=0).
+    if online_data_json is not None:
+        info = tarfile.TarInfo(PROV_ONLINE_DATA_FILENAME)
+        info.size = len(online_data_json)
+        info.mode = 0o640
+        info.mtime = int(time.time())
+        out_tar.addfile(info, io.BytesIO(online_data_json))
+
+
+def _copy_shared_data_entries(out_tar, shared_fileobj, mode="r|"):
+    """Copy the entries of the shared data tarball under import/.
+
+    :param mode: Stream mode to open 'shared_fileobj' with; "r|" for an uncompressed
+                 stream or "r|*" to detect its compression.
+    """
 
-        # Create final tarball:
-        subprocess.check_output(
-            ["tar", "--numeric-owner", "--preserve-permissions",
-             "-czvf", os.path.join(output_dir, PROV_DATA_FILENAME),
-             "-C", tmpdir, *toplvl_entries])
+    import_info = tarfile.TarInfo(PROV_IMPORT_DIRNAME)
+    import_info.type = tarfile.DIRTYPE
+    import_info.mode = 0o511
+    import_info.mtime = int(time.time())
+    import_written = False
+
+    with tarfile.open(fileobj=shared_fileobj, mode=mode) as shared_tar:
+        for member in shared_tar:
+            name = os.path.normpath(member.name.lstrip("/"))
+            if name == "." and member.isdir():
+                # The top directory of the shared data becomes the import/ directory.
+                if not import_written:
+                    import_info.mode = member.mode
+                    import_info.uid, import_info.gid = member.uid, member.gid
+                    import_info.mtime = member.mtime
+                continue
+            if name == ".." or name.startswith("../"):
+                log.warning(f"Ignoring entry '{member.name}' of the shared data tarball.")
+                continue
+            if not import_written:
+                out_tar.addfile(import_info)
+                import_written = True
+            member.name = f"{PROV_IMPORT_DIRNAME}/{name}"
+            if member.islnk():
+                member.linkname = \
+                    f"{PROV_IMPORT_DIRNAME}/{os.path.normpath(member.linkname.lstrip('/'))}"
+            member.uname = member.gname = ""
+            out_tar.addfile(member, shared_tar.extractfile(member) if member.isreg() else None)
+
+    if not import_written:
+        out_tar.addfile(import_info)
 
 
 def prov_add_provdata_tarball(output_dir):
@@ -549,8 +935,11 @@ def provision(input_dir, output_dir, shared_data, online_data, hibernated=False,
                     f"Output directory \"{output_dir}\" already exists: aborting.")
             shutil.rmtree(output_dir)
 
+        # Only image.json changes and a tarball is added, so the copy is cloned
+        # where possible; it is never hardlinked since image.json is rewritten in
+        # place and ownership of the output gets changed.
         log.debug("Creating copy of TorizonCore input image.")
-        shutil.copytree(input_dir, output_dir)
+        clone_tree(input_dir, output_dir)
 
     # Actual provisioning:
     try:
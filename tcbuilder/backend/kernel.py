@@ -189,7 +189,18 @@ def download_toolchain(toolchain, toolchain_path, version_gcc):
              "Please wait this could take a while...")
 
     try:
-        urllib.request.urlretrieve(url, filename=tarball, reporthook=progress)
+        with urllib.request.urlopen(url) as res, open(tarball, "wb") as outf:
+            total_size = int(res.headers.get("Content-Length", -1))
+            # Big blocks for big files, but still frequent enough progress updates.
+            block_size = min(1024 * 1024, max(8192, total_size // 100))
+            blocknum = 0
+            while True:
+                block = res.read(block_size)
+                if not block:
+                    break
+                outf.write(block)
+                blocknum += 1
+                progress(blocknum, block_size, total_size)
         log.info("\nDownload Complete!\n")
     except:
         raise TorizonCoreBuilderError("The requested toolchain could not be downloaded")
@@ -174,6 +174,35 @@ def pull_remote_ref(repo, uri, ref, remote=None, progress=None):
         raise TorizonCoreBuilderError("Error pulling contents from local repository.")
 
 
+def replace_remote(repo, name, remote):
+    """Add remote 'name' (without GPG verification), replacing any existing remote of that name."""
+    options = GLib.Variant("a{sv}", {
+        "gpg-verify": GLib.Variant("b", False)
+    })
+
+    if not repo.remote_change(None, OSTree.RepoRemoteChange.REPLACE, name, remote, options, None):
+        raise TorizonCoreBuilderError(f"Error adding remote {remote}.")
+
+
+def delete_remote(repo, name):
+    """Remove remote 'name' from the repository."""
+    if not repo.remote_delete(name, None):
+        raise TorizonCoreBuilderError(f"Error removing remote {name}.")
+
+
+def create_ref(repo, ref, csum):
+    """Point ref 'ref' at commit 'csum', replacing it if it exists.
+
+    Returns False if the ref could not be set (e.g. 'ref' is not a valid ref name).
+    """
+    try:
+        repo.set_ref_immediate(None, ref, csum, None)
+    except GLib.Error as exc:
+        log.debug(exc.message)
+        return False
+    return True
+
+
 def get_reference_dict(repopath, base_csum=None):
     """
     Get all the references in a ostree repo, excluding the OSTree generated ref.
@@ -195,7 +224,8 @@ def get_reference_dict(repopath, base_csum=None):
     return ref_dict
 
 
-def pull_local_refs(repo: OSTree.Repo, repopath: str, refs: str, remote=None):
+def pull_local_refs(repo: OSTree.Repo, repopath: str, refs: str, remote=None,
+                    disable_fsync=False):
     """
     Fetches references from local repository.
 
@@ -203,6 +233,8 @@ def pull_local_refs(repo: OSTree.Repo, repopath: str, refs: str, remote=None):
     :param repopath: Absolute path of local repository to pull from.
     :param refs: Remote reference to pull.
     :param remote: Remote name used in refspec.
+    :param disable_fsync: Do not fsync the pulled objects (only sensible for
+                          throwaway repositories).
     """
     # With Bullseye's ostree version 2020.7, the following snippet fails with:
     # gi.repository.GLib.GError: g-io-error-quark: Remote "torizon" not found (1)
@@ -220,19 +252,26 @@ def pull_local_refs(repo: OSTree.Repo, repopath: str, refs: str, remote=None):
     repo_fd = repo.get_dfd()
     repo_str = os.readlink(f"/proc/self/fd/{repo_fd}")
 
+    if not refs:
+        return
+
     try:
+        # A single pull-local for all commits: the source repository is opened and its
+        # objects are scanned only once (and hardlinked instead of copied whenever the
+        # repository modes allow that).
+        log.debug(f"Pulling from local repository {repopath} commit checksums "
+                  f"{', '.join(refs.values())}")
+        subprocess.run(
+            [arg for arg in [
+                "ostree",
+                "pull-local",
+                f"--repo={repo_str}",
+                f"--remote={remote}" if remote else None,
+                "--disable-fsync" if disable_fsync else None,
+                repopath] if arg] + list(dict.fromkeys(refs.values())),
+            check=True)
+        repo.reload_config()
         for ref_name, ref_csum in refs.items():
-            log.debug(f"Pulling from local repository {repopath} commit checksum {ref_csum}")
-            subprocess.run(
-                [arg for arg in [
-                    "ostree",
-                    "pull-local",
-                    f"--repo={repo_str}",
-                    f"--remote={remote}" if remote else None,
-                    repopath,
-                    ref_csum] if arg],
-                check=True)
-            repo.reload_config()
             # Note: In theory we can do this with two options in one go, but that seems
             # to validate ref-bindings... (has probably something to do with Collection IDs etc..)
             #"refs": GLib.Variant.new_strv(["base"]),
@@ -13,8 +13,8 @@ import sys
 import shutil
 import subprocess
 
+from concurrent.futures import ThreadPoolExecutor
 from fnmatch import fnmatchcase
-from io import BytesIO, TextIOWrapper
 from tempfile import TemporaryDirectory
 from urllib.parse import urljoin
 
@@ -22,6 +22,8 @@ import docker.errors
 import requests
 import yaml
 
+from requests.adapters import HTTPAdapter
+
 from tcbuilder.errors import \
     (TorizonCoreBuilderError, InvalidDataError, OperationFailureError,
      FetchError)
@@ -33,7 +35,8 @@ from tcbuilder.backend.common import \
     (get_host_workdir, get_own_network, set_output_ownership, run_with_loading_animation,
      validate_compose_file)
 from tcbuilder.backend.registryops import \
-    (RegistryOperations, SHA256_PREFIX, parse_image_name, platform_matches)
+    (RegistryOperations, SHA256_PREFIX, parse_image_name, platform_matches,
+     save_manifests)
 
 log = logging.getLogger("torizon." + __name__)
 
@@ -45,7 +48,15 @@ OFFLINE_SNAPSHOT_FILE = "offline-snapshot.json"
 
 DEFAULT_METADATA_MAXLEN = 4 * 1024 * 1024
 TARGETS_METADATA_MAXLEN = 16 * 1024 * 1024
+# Safe YAML loader for metadata: the one of libyaml (C implementation), if available.
+_SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Size of the blocks in which metadata and target files are read and hashed.
+METADATA_BLOCK_SIZE = 1024 * 1024
 OSTREE_PUBLIC_FEED = "https://feeds.toradex.com/ostree"
+# Timeouts, in seconds, to connect to an OSTree server and to wait for its answer when
+# looking for a commit.
+OSTREE_PROBE_TIMEOUT = (10, 30)
 UNSAFE_FILENAME_CHARS = r'\/:*?"<>|'
 
 RESERVED_LOCKBOX_NAMES = [
@@ -55,12 +66,18 @@ RESERVED_LOCKBOX_NAMES = [
 PROV_IMGREPO_DIRNAME = "repo"
 PROV_DIRECTOR_DIRNAME = "director"
 
+# Maximum number of images whose manifests are fetched from the registries concurrently.
+FETCH_MANIFESTS_WORKERS = 8
+
 UPTANE_SIGN_UPLOAD_TIMEOUT = "60"
 TUF_REPO_DIR = "/deploy/tuf-repo"
 
 # SHA256 Hash Regex
 HASH_REGEX = re.compile(r"^[0-9a-f]{64}$")
 
+# YAML file extension, where ".lock" is inserted to name canonicalized files.
+YAML_EXT_REGEX = re.compile(r"(.ya?ml)$")
+
 FUSE_HARDWAREIDS = {
     "verdin-imx8mp-fuses": "hab",
     "verdin-imx8mm-fuses": "hab",
@@ -74,6 +91,13 @@ FUSE_HARDWAREIDS = {
 
 FUSE_SCHEMA_FILE = "fuse.schema.yaml"
 
+# Session shared by the requests to the OSTree and Uptane servers, so that their
+# connections (and TLS handshakes) are reused; access tokens are still passed per
+# request, as they must not reach the public feed.
+_http_session = requests.Session()
+for _prefix in ("https://", "http://"):
+    _http_session.mount(_prefix, HTTPAdapter(pool_connections=16, pool_maxsize=32))
+
 
 def load_metadata(fname, ftype=None, maxlen=DEFAULT_METADATA_MAXLEN):
     """Load metadata file and determine some of its attributes (size, sha256).
@@ -86,20 +110,23 @@ def load_metadata(fname, ftype=None, maxlen=DEFAULT_METADATA_MAXLEN):
                    exceeded.
     """
 
-    # Load all file into memory.
-    with open(fname, "rb") as fileh:
-        data = fileh.read(maxlen + 1)
-        assert len(data) <= maxlen, \
-            f"File {fname} is larger than {maxlen} bytes (giving up)"
-
-    # Wrap data into a text stream for loading.
-    data_as_stream = BytesIO(data)
-    data_as_text = TextIOWrapper(data_as_stream, encoding="utf-8")
-
+    # Load the file into memory, hashing it block by block as it is read.
     data_sha256_ = hashlib.sha256()
-    data_sha256_.update(data)
+    data = bytearray()
+    with open(fname, "rb") as fileh:
+        while True:
+            buf = fileh.read(METADATA_BLOCK_SIZE)
+            if not buf:
+                break
+            data_sha256_.update(buf)
+            data += buf
+            assert len(data) <= maxlen, \
+                f"File {fname} is larger than {maxlen} bytes (giving up)"
     data_sha256 = data_sha256_.hexdigest()
 
+    # Decode the data once, for the parser to work on the whole string.
+    data_as_text = data.decode("utf-8")
+
     log.debug(f"File {fname}: sha256sum: {data_sha256}")
 
     # Determine parser to be used:
@@ -111,9 +138,9 @@ def load_metadata(fname, ftype=None, maxlen=DEFAULT_METADATA_MAXLEN):
 
     # Parse file.
     if ftype == "json":
-        parsed = json.load(data_as_text)
+        parsed = json.loads(data_as_text)
     else:
-        parsed = yaml.safe_load(data_as_text)
+        parsed = yaml.load(data_as_text, Loader=_SafeLoader)
 
     return {
         "file": fname, "size": len(data), "sha256": data_sha256, "parsed": parsed
@@ -137,11 +164,11 @@ def check_commit_present(ostree_url, commit_sha256, access_token=None):
     # Try to access resource using the HEAD method.
     if access_token:
         assert url.lower().startswith("https://")
-        res = requests.head(
-            url, allow_redirects=True,
+        res = _http_session.head(
+            url, allow_redirects=True, timeout=OSTREE_PROBE_TIMEOUT,
             headers={"Authorization": f"Bearer {access_token}"})
     else:
-        res = requests.head(url, allow_redirects=True)
+        res = _http_session.head(url, allow_redirects=True, timeout=OSTREE_PROBE_TIMEOUT)
 
     if res.status_code == requests.codes["ok"]:
         return True
@@ -157,26 +184,21 @@ def check_commit_present(ostree_url, commit_sha256, access_token=None):
 def do_fetch_ostree_target(target, sha256, ostree_url, images_dir, access_token=None):
     """Helper to fetch a given commit from a specified OSTree repo"""
 
-    # Evaluate using libostree for the work done by this function (FUTURE).
-    # Create a local repo.
+    # Create a local repo (through libostree, but for the pull, to save running the CLI).
     repo_dir = os.path.join(images_dir, "ostree")
     if not os.path.exists(repo_dir):
         log.debug(f"Initializing OSTree at '{repo_dir}'")
         os.mkdir(repo_dir)
-        subprocess.run(
-            ["ostree", "init", "--repo", repo_dir, "--mode=archive"],
-            check=True)
+        repo = ostree.create_ostree(repo_dir)
     else:
         log.debug(f"Reusing existing OSTree repo at '{repo_dir}'")
+        repo = ostree.open_ostree(repo_dir)
 
     # Add a temporary remote.
     remote_name = "tmpremote"
-    subprocess.run(
-        ["ostree", "remote", "add", remote_name,
-         "--repo", repo_dir, ostree_url, "--no-gpg-verify", "--force"],
-        check=True)
+    ostree.replace_remote(repo, remote_name, ostree_url)
 
-    # Pull our hashref.
+    # Pull our hashref (with the CLI, which reports the progress of the pull).
     pull_cmd = ["ostree", "pull", "--repo", repo_dir, remote_name, sha256]
     if access_token:
         # Add authorization header (that is supposed to be valid for hours) (FIXME):
@@ -187,24 +209,16 @@ def do_fetch_ostree_target(target, sha256, ostree_url, images_dir, access_token=
     subprocess.run(pull_cmd, check=True)
 
     # Create a ref named after the target.
-    try:
-        subprocess.run(
-            ["ostree", "refs", "--repo", repo_dir, "--create", target, sha256, "--force"],
-            check=True, capture_output=True, text=True)
-
-    except subprocess.CalledProcessError as called_process_error:
+    if not ostree.create_ref(repo, target, sha256):
         # Setting the ref name is nice but not strictly required; it might fail if
         # the target name does not match the naming pattern allowed by OSTree. A
         # possible improvement would be to sanitize the name to be in accordance
         # with the allowed pattern which can be seen in OSTree's source code, file
         # ostree-core.c, macro `OSTREE_REF_REGEXP`.
-        log.debug(called_process_error.stderr)
         log.debug("Could not create ref according to Uptane target name (non-fatal)")
 
     # Remove remote.
-    subprocess.run(
-        ["ostree", "remote", "delete", remote_name, "--repo", repo_dir],
-        check=True)
+    ostree.delete_remote(repo, remote_name)
 
 
 def fetch_ostree_target(target, sha256, ostree_url, images_dir,
@@ -225,23 +239,32 @@ def fetch_ostree_target(target, sha256, ostree_url, images_dir,
 
     log.info(f"Handling OSTree target '{target}'")
 
-    # Try to find commit on the user's repo first and then on the public feed.
-    log.debug(f"Looking for commit {sha256} on the user's repo")
+    # Look for the commit on the user's repo and on the public feed at the same time, so
+    # the answer of the public feed is at hand when the user's repo does not have it. The
+    # user's repo is preferred.
+    log.debug(f"Looking for commit {sha256} on the user's repo and on public feed")
     server_url, server_token = None, None
-    commit_present = check_commit_present(
-        ostree_url, commit_sha256=sha256, access_token=access_token)
-    if commit_present:
-        log.info(f"Commit {sha256} found on the user's repo")
-        server_url = ostree_url
-        server_token = access_token
-    else:
-        log.debug(f"Looking for commit {sha256} on public feed")
+    # The executor is not used as a context manager: that would wait for the public feed
+    # even when the user's repo already has the commit.
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        user_repo_probe = executor.submit(
+            check_commit_present, ostree_url, commit_sha256=sha256, access_token=access_token)
         # For security reasons, we must not use the access-token with the public feed:
-        commit_present = check_commit_present(
-            OSTREE_PUBLIC_FEED, commit_sha256=sha256)
+        public_feed_probe = executor.submit(
+            check_commit_present, OSTREE_PUBLIC_FEED, commit_sha256=sha256)
+        commit_present = user_repo_probe.result()
         if commit_present:
-            server_url = OSTREE_PUBLIC_FEED
-            server_token = None
+            log.info(f"Commit {sha256} found on the user's repo")
+            server_url = ostree_url
+            server_token = access_token
+        else:
+            commit_present = public_feed_probe.result()
+            if commit_present:
+                server_url = OSTREE_PUBLIC_FEED
+                server_token = None
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
     if not commit_present:
         raise TorizonCoreBuilderError(
@@ -284,45 +307,67 @@ def fetch_validate(url, fname, dest_dir,
     # Fetch the file:
     if access_token:
         assert url.lower().startswith("https://")
-        res = requests.get(
-            url, headers={"Authorization": f"Bearer {access_token}"})
+        res = _http_session.get(
+            url, headers={"Authorization": f"Bearer {access_token}"}, stream=True)
     else:
-        res = requests.get(url)
-
-    if res.status_code != requests.codes["ok"]:
-        raise FetchError(
-            f"Could not fetch file '{fname}' from '{url}'",
-            status_code=res.status_code)
-
-    if length is not None and len(res.content) != length:
-        raise InvalidDataError(
-            f"Downloaded file '{fname}' has wrong length "
-            f"(actual={len(res.content)}, expected={length} bytes)")
-
-    # Determine the sha256 of the data:
-    content_sha256_ = hashlib.sha256()
-    content_sha256_.update(res.content)
-    content_sha256 = content_sha256_.hexdigest()
-
-    if sha256 is not None and content_sha256 != sha256:
-        raise InvalidDataError(
-            f"Downloaded file '{fname}' has wrong sha256 checksum "
-            f"(actual='{content_sha256}', expected='{sha256}')")
-
-    # Write file into destination:
-    fname = os.path.join(dest_dir, fname)
-    os.makedirs(os.path.dirname(fname), exist_ok=True)
-    with open(fname, "wb") as cmph:
-        cmph.write(res.content)
+        res = _http_session.get(url, stream=True)
+
+    with res:
+        if res.status_code != requests.codes["ok"]:
+            raise FetchError(
+                f"Could not fetch file '{fname}' from '{url}'",
+                status_code=res.status_code)
+
+        # Write file into destination, determining its length and sha256 on the way:
+        fname = os.path.join(dest_dir, fname)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        content_sha256_ = hashlib.sha256()
+        content_length = 0
+        try:
+            with open(fname, "wb") as cmph:
+                if length:
+                    # Reserve the space of the file at once, so it is not fragmented.
+                    try:
+                        os.posix_fallocate(cmph.fileno(), 0, length)
+                    except OSError:
+                        pass
+                for chunk in res.iter_content(chunk_size=METADATA_BLOCK_SIZE):
+                    content_length += len(chunk)
+                    if length is not None and content_length > length:
+                        # No need to download the rest of a file which is too long.
+                        raise InvalidDataError(
+                            f"Downloaded file '{fname}' has wrong length "
+                            f"(more than the expected {length} bytes)")
+                    content_sha256_.update(chunk)
+                    cmph.write(chunk)
+            content_sha256 = content_sha256_.hexdigest()
+
+            if length is not None and content_length != length:
+                raise InvalidDataError(
+                    f"Downloaded file '{fname}' has wrong length "
+                    f"(actual={content_length}, expected={length} bytes)")
+
+            if sha256 is not None and content_sha256 != sha256:
+                raise InvalidDataError(
+                    f"Downloaded file '{fname}' has wrong sha256 checksum "
+                    f"(actual='{content_sha256}', expected='{sha256}')")
+        except BaseException:
+            # Do not leave a partial or invalid file behind.
+            if os.path.exists(fname):
+                os.unlink(fname)
+            raise
+
     log.debug(f"Written file '{fname}' with {length} bytes, sha256='{sha256}'")
 
     ret = None
     if parse is None:
         pass
     elif parse == "json":
-        ret = json.loads(res.text)
+        with open(fname, "rb") as cmph:
+            ret = json.load(cmph)
     elif parse == "yaml":
-        ret = yaml.safe_load(res.text)
+        with open(fname, "rb") as cmph:
+            ret = yaml.load(cmph, Loader=_SafeLoader)
     else:
         assert False, f"Bad argument to fetch_validate(): parse={parse}"
 
@@ -418,25 +463,33 @@ def fetch_manifests(images, manifests_dir,
              - "manifest-file": name of the manifest file where data is stored
     """
 
-    digests_cache = set()
-    manifests_per_image = {}
-    for image in images:
-        if verbose:
-            log.info(f"\nFetching manifests for {image}...")
+    def _fetch_one(image):
+        # Only download here: saving and logging are done by the caller, in order.
         image_parsed = parse_image_name(image)
 
         ops = RegistryOperations(image_parsed.registry)
-        digests_saved, manifests_info = ops.save_all_manifests(
-            image_parsed.get_name_with_tag(), manifests_dir,
+        return list(ops.get_all_manifests(
+            image_parsed.get_name_with_tag(),
             platforms=req_platforms,
-            val_digest=validate)
-        digests_cache.update(digests_saved)
+            val_digest=validate))
+
+    # Fetching is bound by the latency of the registries, so do it for all images at once.
+    digests_cache = set()
+    manifests_per_image = {}
+    unique_images = list(dict.fromkeys(images))
+    with ThreadPoolExecutor(max_workers=FETCH_MANIFESTS_WORKERS) as executor:
+        results = executor.map(_fetch_one, unique_images)
+        for image, manifests in zip(unique_images, results):
+            if verbose:
+                log.info(f"\nFetching manifests for {image}...")
 
-        # Use cache to avoid fetching manifest multiple times (FUTURE).
-        # This would be relevant only if the digest is referenced by the
-        # manifest-list and also directly: this is expected to be rare.
+            # Use cache to avoid saving the same manifest multiple times (this
+            # happens when images share a digest).
+            digests_saved, manifests_info = save_manifests(
+                manifests, manifests_dir, cached=digests_cache)
+            digests_cache.update(digests_saved)
 
-        manifests_per_image[image] = manifests_info
+            manifests_per_image[image] = manifests_info
 
     # log.debug(f"manifests_per_image: {json.dumps(manifests_per_image)}")
     if verbose:
@@ -1426,7 +1479,7 @@ def canonicalize_compose_file(compose_file, force=False):
         log.info(f"File '{compose_file}' is already in canonical form.")
         return compose_file
 
-    canonical_compose_file_lock = re.sub(r"(.ya?ml)$", r".lock\1", compose_file)
+    canonical_compose_file_lock = YAML_EXT_REGEX.sub(r".lock\1", compose_file)
     if os.path.exists(canonical_compose_file_lock) and not force:
         raise TorizonCoreBuilderError(
             f"Canonicalized file '{canonical_compose_file_lock}' already exists. "
@@ -1638,7 +1691,7 @@ def canonicalize_fuse_file(fuse_file, force=False):
         log.info(f"File '{fuse_file}' is already in canonical form.")
         return fuse_file
 
-    canonical_fuse_file_lock = re.sub(r"(.ya?ml)$", r".lock\1", fuse_file)
+    canonical_fuse_file_lock = YAML_EXT_REGEX.sub(r".lock\1", fuse_file)
     if os.path.exists(canonical_fuse_file_lock) and not force:
         raise TorizonCoreBuilderError(
             f"Canonicalized file '{canonical_fuse_file_lock}' already exists. "
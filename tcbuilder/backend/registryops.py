@@ -1,5 +1,6 @@
 """Helper functions and classes for working with Docker registries."""
 
+import functools
 import hashlib
 import logging
 import os
@@ -205,6 +206,15 @@ def parse_image_name(image_name):
     ImageName(registry='gcr.io', name='ubuntu', tag='latest')
     """
 
+    # A new object every time, since callers may modify it (e.g. by set_tag()).
+    return ParsedImageName(*_split_image_name(image_name))
+
+
+# The same image names are parsed several times while handling a compose file.
+@functools.lru_cache(maxsize=256)
+def _split_image_name(image_name):
+    """Split an image name into a (registry, name, tag) tuple; see parse_image_name()"""
+
     mres = re.match(r"^([a-zA-Z][-+.a-zA-Z0-9]+)://", image_name)
     if mres:
         raise TorizonCoreBuilderError(
@@ -229,7 +239,7 @@ def parse_image_name(image_name):
         # E.g. ubuntu
         name, tag = name_with_tag, None
 
-    return ParsedImageName(registry, name, tag)
+    return registry, name, tag
 
 
 def validate_registries(registries):
@@ -666,39 +676,58 @@ class RegistryOperations:
                            "ubuntu@sha256:123123..."
         :param cached: Iterable with the digests already fetched (TODO).
         """
-        manifests_info = []
-        saved_digests = []
         kwargs = {
             "headers": headers,
             "platforms": platforms,
             "val_digest": val_digest
         }
-        # TODO: Pass `cached` to get_all_manifests().
-        for info, resp in self.get_all_manifests(image_name, **kwargs):
-            # Determine destination.
-            _fname = info["digest"]
-            assert _fname.startswith(SHA256_PREFIX)
-            _fname = _fname[len(SHA256_PREFIX):]
-            _dest = os.path.join(dest_dir, _fname + ".json")
-
-            # Save some information about the image.
-            manifests_info.append({
-                "type": info["type"],
-                "name": info["name"],
-                "digest": info["digest"],
-                "platform": info["platform"],
-                "manifest-file": _dest
-            })
-
-            # Save file:
-            _plattxt = f" [{info['platform']}]" if info['platform'] else ""
-            log.info(f"Saving {info['type']} of {info['name']}{_plattxt}")
-            # log.debug(f"Saving {info['type']} of {info['name']}{_plattxt} into {_dest}")
-            with open(_dest, "wb") as fileh:
-                fileh.write(resp.content)
-            saved_digests.append(info["digest"])
-
-        return saved_digests, manifests_info
+        return save_manifests(
+            self.get_all_manifests(image_name, **kwargs), dest_dir)
+
+
+def save_manifests(manifests, dest_dir, cached=None):
+    """Save manifests as yielded by `RegistryOperations.get_all_manifests()`
+
+    :param manifests: Iterable of (info, resp) pairs with the manifests to save.
+    :param dest_dir: Destination directory of the manifests.
+    :param cached: Iterable with the digests already saved into `dest_dir`; those
+                   are not written again.
+    :return: Tuple (saved_digests, manifests_info) where saved_digests are the
+             digests of the manifests written by this call.
+    """
+    cached = set(cached or [])
+    manifests_info = []
+    saved_digests = []
+    for info, resp in manifests:
+        # Determine destination.
+        _fname = info["digest"]
+        assert _fname.startswith(SHA256_PREFIX)
+        _fname = _fname[len(SHA256_PREFIX):]
+        _dest = os.path.join(dest_dir, _fname + ".json")
+
+        # Save some information about the image.
+        manifests_info.append({
+            "type": info["type"],
+            "name": info["name"],
+            "digest": info["digest"],
+            "platform": info["platform"],
+            "manifest-file": _dest
+        })
+
+        if info["digest"] in cached:
+            log.debug(f"Manifest {info['digest']} already saved")
+            continue
+
+        # Save file:
+        _plattxt = f" [{info['platform']}]" if info['platform'] else ""
+        log.info(f"Saving {info['type']} of {info['name']}{_plattxt}")
+        # log.debug(f"Saving {info['type']} of {info['name']}{_plattxt} into {_dest}")
+        with open(_dest, "wb") as fileh:
+            fileh.write(resp.content)
+        saved_digests.append(info["digest"])
+        cached.add(info["digest"])
+
+    return saved_digests, manifests_info
 
 
 def platform_str(platform):
@@ -713,6 +742,8 @@ def platform_str(platform):
     return _platform
 
 
+# The same few platform strings are compared over and over when selecting images.
+@functools.lru_cache(maxsize=1024)
 def platform_matches(plat1, plat2, ret_grade=False):
     """Determine if two platform specification strings match.
 
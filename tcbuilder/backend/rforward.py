@@ -33,6 +33,9 @@ import logging
 
 SSH_PORT = 22
 DEFAULT_PORT = 4000
+# Size of the reads done when forwarding data; large enough to move a typical
+# OSTree object with few system calls.
+FORWARD_BUFSIZE = 256 * 1024
 
 log = logging.getLogger("torizon." + __name__)
 
@@ -47,15 +50,15 @@ def handler(chan, host, port):
         r, _w, _x = select.select([sock, chan], [], [])
         # pylint: enable=invalid-name
         if sock in r:
-            data = sock.recv(1024)
+            data = sock.recv(FORWARD_BUFSIZE)
             if len(data) == 0:
                 break
-            chan.send(data)
+            chan.sendall(data)
         if chan in r:
-            data = chan.recv(1024)
+            data = chan.recv(FORWARD_BUFSIZE)
             if len(data) == 0:
                 break
-            sock.send(data)
+            sock.sendall(data)
     chan.close()
     sock.close()
     log.debug(f"Tunnel closed from {chan.origin_addr}")
@@ -6,6 +6,8 @@ import os
 import logging
 import shutil
 import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from tezi.errors import TeziError
@@ -209,31 +211,60 @@ def handle_dt_customization(props, storage_dir=None):
     if props:
         log.info(l2_pref("Handling device-tree subsection"))
 
-    if "custom" in props:
-        log.info(l2_pref(f"Selecting custom device-tree '{props['custom']}'"))
-        dt_cli.dt_apply(dts_path=props["custom"],
-                        storage_dir=storage_dir,
-                        include_dirs=props.get("include-dirs", []))
-
     overlay_props = props.get("overlays", {})
-    if overlay_props.get("clear", False):
-        dto_cli.dto_remove_all(storage_dir)
-
-        if "remove" in overlay_props:
-            log.info("Individual overlay removal ignored because they've all been "
-                     "removed due to the 'clear' property")
-
-    elif "remove" in overlay_props:
-        for overl in overlay_props["remove"]:
-            dto_cli.dto_remove_single(overl, storage_dir, presence_required=False)
+    # The compiled overlays are kept in a temporary directory that goes away with any
+    # blob left in it (e.g. when a later step fails).
+    with tempfile.TemporaryDirectory() as dtob_tmp_dir, \
+         ThreadPoolExecutor(max_workers=1) as executor:
+        # The overlays do not depend on the device tree selected below: start compiling them
+        # (in parallel) right away so that this overlaps with the work on the device tree;
+        # applying them stays sequential because each one is tested against the previously
+        # applied ones.
+        dto_build_future = None
+        if "add" in overlay_props:
+            dto_build_future = executor.submit(
+                dto_cli.dto_build, overlay_props["add"], props.get("include-dirs", []),
+                tmp_dir=dtob_tmp_dir)
+
+        if "custom" in props:
+            log.info(l2_pref(f"Selecting custom device-tree '{props['custom']}'"))
+            dt_cli.dt_apply(dts_path=props["custom"],
+                            storage_dir=storage_dir,
+                            include_dirs=props.get("include-dirs", []))
+
+        if overlay_props.get("clear", False):
+            dto_cli.dto_remove_all(storage_dir)
+
+            if "remove" in overlay_props:
+                log.info("Individual overlay removal ignored because they've all been "
+                         "removed due to the 'clear' property")
+
+        elif "remove" in overlay_props:
+            for overl in overlay_props["remove"]:
+                dto_cli.dto_remove_single(overl, storage_dir, presence_required=False)
+
+        if dto_build_future is None:
+            return
 
-    if "add" in overlay_props:
         # We enable the overlay apply test only if it is possible to do it.
         test_apply = bool(dt_be.get_current_dtb_basename(storage_dir))
         if not test_apply:
             log.info("Not testing overlay because base image does not have a "
                      "device-tree set!")
-        for overl in overlay_props["add"]:
+        dtob_tmp_paths = dto_build_future.result()
+
+        # Stop before applying anything if an overlay failed to build (its errors were
+        # already reported by dto_build).
+        for overl, dtob_tmp_path in zip(overlay_props["add"], dtob_tmp_paths):
+            if dtob_tmp_path is None:
+                log.error(f"error: cannot apply {overl}.")
+                sys.exit(1)
+
+        # Testing the whole set at once is enough when it succeeds; otherwise each overlay
+        # is tested as it is applied, so that the failing one is reported.
+        if test_apply and dto_cli.dto_test_apply_all(dtob_tmp_paths, storage_dir):
+            test_apply = False
+        for overl, dtob_tmp_path in zip(overlay_props["add"], dtob_tmp_paths):
             log.info(l2_pref(f"Adding device-tree overlay '{overl}'"))
             dto_cli.dto_apply(
                 dtos_path=overl,
@@ -241,7 +272,8 @@ def handle_dt_customization(props, storage_dir=None):
                 include_dirs=props.get("include-dirs", []),
                 storage_dir=storage_dir,
                 allow_reapply=False,
-                test_apply=test_apply)
+                test_apply=test_apply,
+                dtob_tmp_path=dtob_tmp_path)
 
 
 def handle_kernel_customization(props, storage_dir=None):
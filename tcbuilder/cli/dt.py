@@ -4,7 +4,6 @@ CLI for the DT (device-tree) command.
 
 import logging
 import os
-import shlex
 import shutil
 import subprocess
 import sys
@@ -110,14 +109,14 @@ def dt_apply(dts_path, storage_dir, include_dirs=None):
     uenv_target_dir = os.path.join(dt_changes_dir, "usr", "lib", "ostree-boot")
     os.makedirs(uenv_target_dir, exist_ok=True)
     uenv_target_path = os.path.join(uenv_target_dir, "uEnv.txt")
+    # Keep the rest of the base uEnv.txt, minus its own fdtfile setting.
+    base_uenv = subprocess.check_output(
+        ["ostree", f"--repo={storage_dir}/ostree-archive",
+         "cat", "base", "/usr/lib/ostree-boot/uEnv.txt"], text=True)
     with open(uenv_target_path, "w") as file:
         file.write(f"fdtfile={dtb_target_basename}\n")
-    subprocess.check_call(
-        "set -o pipefail && "
-        f"ostree --repo={shlex.quote(storage_dir)}/ostree-archive "
-        f"cat base /usr/lib/ostree-boot/uEnv.txt | sed /^fdtfile=/d "
-        f">>{shlex.quote(uenv_target_path)}",
-        shell=True)
+        file.writelines(line for line in base_uenv.splitlines(keepends=True)
+                        if not line.startswith("fdtfile="))
 
     # Deploy an empty overlays config file, so any overlays from the base image are disabled.
     log.info("warning: removing currently applied device tree overlays")
@@ -7,6 +7,7 @@ import shutil
 import subprocess
 import sys
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 from tcbuilder.backend import dt, dto, common
 from tcbuilder.backend.common import images_unpack_executed, unpacked_image_type
@@ -32,9 +33,61 @@ log = logging.getLogger("torizon." + __name__)
 # - target: functional output artifact in filesystem
 
 
-# pylint: disable=too-many-locals
+def dto_build(dtos_paths, include_dirs, tmp_dir=None):
+    '''Compile a set of device tree overlays concurrently.
+
+    :param dtos_paths: list of full paths to the source device-tree overlay files.
+    :param include_dirs: list of directories where to search include files when building the
+                         overlay files.
+    :param tmp_dir: directory where to create the temporary blobs (the system default when
+                    not passed).
+    :returns: list with the path to the temporary blob of each overlay, in the same order as
+              `dtos_paths`; entries are None for the overlays that failed to compile.
+    '''
+
+    def build_one(dtos_path):
+        with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmpf:
+            dtob_tmp_path = tmpf.name
+        if not dt.build_dts(dtos_path, include_dirs, dtob_tmp_path):
+            os.remove(dtob_tmp_path)
+            return None
+        return dtob_tmp_path
+
+    # Each compilation is an independent "cpp | dtc" pipeline, so they can run side by side.
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        return list(executor.map(build_one, dtos_paths))
+
+
+def dto_test_apply_all(dtob_tmp_paths, storage_dir):
+    '''Test apply a set of compiled overlays at once.
+
+    The overlays are applied, in order, over the current device tree and the overlays already
+    applied to it, with a single run of fdtoverlay.
+
+    :param dtob_tmp_paths: list of paths to the compiled overlay blobs (see `dto_build`).
+    :param storage_dir: path to root directory where most operations will be performed.
+    :returns: True if all overlays can be applied together; False if that could not be
+              verified, in which case the overlays should be tested one by one.
+    '''
+
+    if not dtob_tmp_paths or None in dtob_tmp_paths:
+        return False
+    (dtb_path, is_dtb_exact) = dt.get_current_dtb_path(storage_dir)
+    if not is_dtb_exact:
+        return False
+    applied_overlay_paths = dto.get_applied_overlay_paths(storage_dir)
+    with tempfile.NamedTemporaryFile(suffix=".dtb") as tmpf:
+        if not dto.modify_dtb_by_overlays(dtb_path, applied_overlay_paths + dtob_tmp_paths,
+                                          tmpf.name, report_errors=False):
+            return False
+    log.info(f"All {len(dtob_tmp_paths)} overlay(s) can successfully modify the device "
+             f"tree '{os.path.basename(dtb_path)}'.")
+    return True
+
+
+# pylint: disable=too-many-locals,too-many-arguments
 def dto_apply(dtos_path, dtb_path, include_dirs, storage_dir,
-              allow_reapply=False, test_apply=True):
+              allow_reapply=False, test_apply=True, dtob_tmp_path=None):
     '''Execute most of the work of 'dto apply' command.
 
     :param dtos_path: the full path to the source device-tree overlay file to be applied.
@@ -46,6 +99,8 @@ def dto_apply(dtos_path, dtb_path, include_dirs, storage_dir,
     :param allow_reapply: whether or not to allow an overlay to be applied another time.
     :param test_apply: whether or not to apply the overlay over the device tree to check for
                        errors.
+    :param dtob_tmp_path: path to a temporary blob already compiled from `dtos_path` (e.g. by
+                          `dto_build`); when not passed the overlay is compiled here.
     '''
 
     images_unpack_executed(storage_dir)
@@ -68,9 +123,9 @@ def dto_apply(dtos_path, dtb_path, include_dirs, storage_dir,
         applied_overlay_basenames.remove(dtob_target_basename)
 
     # Compile the overlay.
-    with tempfile.NamedTemporaryFile(delete=False) as tmpf:
-        dtob_tmp_path = tmpf.name
-    if not dt.build_dts(dtos_path, include_dirs, dtob_tmp_path):
+    if dtob_tmp_path is None:
+        dtob_tmp_path = dto_build([dtos_path], include_dirs)[0]
+    if dtob_tmp_path is None:
         log.error(f"error: cannot apply {dtos_path}.")
         sys.exit(1)
 
@@ -96,12 +151,13 @@ def dto_apply(dtos_path, dtb_path, include_dirs, storage_dir,
 
         applied_overlay_paths = \
             dto.get_applied_overlay_paths(storage_dir, base_names=applied_overlay_basenames)
-        with tempfile.NamedTemporaryFile(delete=False) as tmpf:
-            dtb_tmp_path = tmpf.name
-        if not dto.modify_dtb_by_overlays(dtb_path,
-                                          applied_overlay_paths + [dtob_tmp_path], dtb_tmp_path):
-            log.error(f"error: overlay '{dtos_path}' is not applicable.")
-            sys.exit(1)
+        # The modified device tree is only needed for the test: keep it in a temporary file
+        # that goes away by itself.
+        with tempfile.NamedTemporaryFile(suffix=".dtb") as tmpf:
+            if not dto.modify_dtb_by_overlays(dtb_path, applied_overlay_paths + [dtob_tmp_path],
+                                              tmpf.name):
+                log.error(f"error: overlay '{dtos_path}' is not applicable.")
+                sys.exit(1)
         log.info(f"'{dtob_target_basename}' can successfully modify the device "
                  f"tree '{os.path.basename(dtb_path)}'.")
 
@@ -123,7 +179,7 @@ def dto_apply(dtos_path, dtb_path, include_dirs, storage_dir,
     # All set :-)
     log.info(f"Overlay {dtob_target_basename} successfully applied.")
 
-# pylint: enable=too-many-locals
+# pylint: enable=too-many-locals,too-many-arguments
 
 
 def do_dto_apply(args):
@@ -63,23 +63,15 @@ def kernel_build_module(source_dir, storage_dir, autoload):
     makefile = os.path.join(source_dir, "Makefile")
     if not os.path.exists(makefile):
         raise PathNotExistError(f'Makefile "{makefile}" does not exist')
-    file = open(makefile, 'r')
-    lines = file.readlines()
-    kernel_check = None
-    for line in lines:
-        if kernel_check is None:
-            kernel_check = re.search("KERNEL_SRC", line)
-        if kernel_check is None:
-            kernel_check = re.search("KDIR", line)
-    if kernel_check is None:
+    with open(makefile, 'r') as file:
+        makefile_contents = file.read()
+    if "KERNEL_SRC" not in makefile_contents and "KDIR" not in makefile_contents:
         raise FileContentMissing(f'KERNEL_SRC not found in "{makefile}"')
 
     # Find and unpack linux source
-    linux_src = subprocess.check_output(
-        ["find", os.path.join(storage_dir, "sysroot/ostree/deploy"),
-         "-type", "f", "-name", "linux.tar.bz2", "-print", "-quit"], text=True)
+    deploy_dir = os.path.join(storage_dir, "sysroot/ostree/deploy")
+    linux_src = dt.find_first(deploy_dir, "linux.tar.bz2")
     assert linux_src, "panic: missing Linux kernel source!"
-    linux_src = linux_src.rstrip()
     tarcmd = [
         "tar",
         "-xf", linux_src,
@@ -93,10 +85,8 @@ def kernel_build_module(source_dir, storage_dir, autoload):
     kernel_subdir = os.path.dirname(dt.get_dtb_kernel_subdir(storage_dir))
     mod_path = os.path.join(kernel_changes_dir, kernel_subdir)
     os.makedirs(mod_path, exist_ok=True)
-    usr_dir = subprocess.check_output(
-        ["find", os.path.join(storage_dir, "sysroot/ostree/deploy"),
-         "-type", "d", "-name", "usr", "-print", "-quit"],
-        text=True).rstrip()
+    usr_dir = dt.find_first(deploy_dir, "usr", want_dir=True)
+    assert usr_dir, "panic: missing /usr directory in base image!"
     src_mod_dir = os.path.join(os.path.dirname(usr_dir), kernel_subdir)
     src_ostree_archive_dir = os.path.join(storage_dir, "ostree-archive")
 
@@ -250,15 +240,10 @@ def assert_custom_kargs_compat_image(storage_dir):
     """
 
     uenv_txt_path = dt.get_current_uenv_txt_path(storage_dir)
-    handling_code_found = False
-
-    re_searched = re.compile(UENV_SET_CUSTOM_ARGS_FUNCTION_RE)
 
     with open(uenv_txt_path, 'r') as file:
-        for line in file:
-            if re_searched.match(line):
-                handling_code_found = True
-                break
+        handling_code_found = re.search(UENV_SET_CUSTOM_ARGS_FUNCTION_RE, file.read(),
+                                        re.MULTILINE)
 
     if not handling_code_found:
         log.error("The TorizonCore image you are customizing doesn't support "
@@ -0,0 +1,117 @@
+"""Unit tests for the raw image partition layout handling of the deploy backend"""
+
+from tcbuilder.backend import deploy
+
+# pylint: disable=protected-access
+
+
+def _gpt_table():
+    """Partition table of a typical base WIC image, as dumped by 'sfdisk --json'"""
+    return {
+        "label": "gpt",
+        "id": "AAAAAAAA-BBBB-CCCC-DDDD-EEEEEEEEEEEE",
+        "sectorsize": 512,
+        "partitions": [
+            {"node": "base.wic2", "start": 133120, "size": 3000000,
+             "type": "0FC63DAF-8483-4772-8E79-3D69D8477DE4",
+             "uuid": "22222222-2222-2222-2222-222222222222", "name": "otaroot"},
+            {"node": "base.wic1", "start": 8192, "size": 124928,
+             "type": "C12A7328-F81F-11D2-BA4B-00A0C93EC93B",
+             "uuid": "11111111-1111-1111-1111-111111111111", "name": "boot",
+             "attrs": "LegacyBIOSBootable"},
+        ]
+    }
+
+
+def test_split_raw_partitions():
+    """The rootfs is picked by partition number and the rest is sorted"""
+
+    rootfs, kept = deploy._split_raw_partitions(_gpt_table(), "/dev/sda2")
+    assert rootfs["name"] == "otaroot"
+    assert [part["name"] for part in kept] == ["boot"]
+
+
+def test_split_raw_partitions_unsupported():
+    """Unsupported layouts are reported as None"""
+
+    table = _gpt_table()
+    assert deploy._split_raw_partitions(table, "/dev/sda3") is None
+
+    table["label"] = "sun"
+    assert deploy._split_raw_partitions(table, "/dev/sda2") is None
+
+    table = _gpt_table()
+    table["label"] = "dos"
+    table["partitions"][0]["node"] = "base.wic5"
+    assert deploy._split_raw_partitions(table, "/dev/sda5") is None
+
+
+def test_raw_rootfs_start():
+    """The new rootfs goes after the kept partitions, aligned to 1 MiB"""
+
+    rootfs, kept = deploy._split_raw_partitions(_gpt_table(), "/dev/sda2")
+    assert deploy._raw_rootfs_start(kept, rootfs, 512) == 133120
+
+    kept[0]["size"] += 1
+    assert deploy._raw_rootfs_start(kept, rootfs, 512) == 133120 + 2048
+
+    assert deploy._raw_rootfs_start([], rootfs, 4096) == 133120
+
+
+def test_sfdisk_script_gpt():
+    """Kept partitions keep their attributes; the rootfs takes the rest of the disk"""
+
+    table = _gpt_table()
+    rootfs, kept = deploy._split_raw_partitions(table, "/dev/sda2")
+    script = deploy._sfdisk_script(table, kept, rootfs, 135168)
+    assert script == [
+        "label: gpt",
+        "unit: sectors",
+        "label-id: AAAAAAAA-BBBB-CCCC-DDDD-EEEEEEEEEEEE",
+        'start=8192, size=124928, type=C12A7328-F81F-11D2-BA4B-00A0C93EC93B, '
+        'uuid="11111111-1111-1111-1111-111111111111", name="boot", attrs="LegacyBIOSBootable"',
+        'start=135168, type=0FC63DAF-8483-4772-8E79-3D69D8477DE4, name="otaroot"',
+    ]
+
+
+def test_sfdisk_script_dos():
+    """MBR partitions keep their type and bootable flag"""
+
+    table = {
+        "label": "dos",
+        "id": "0x12345678",
+        "partitions": [
+            {"node": "base.img1", "start": 2048, "size": 65536, "type": "c",
+             "bootable": True},
+            {"node": "base.img2", "start": 67584, "size": 1000000, "type": "83"},
+        ]
+    }
+    rootfs, kept = deploy._split_raw_partitions(table, "/dev/sda2")
+    script = deploy._sfdisk_script(table, kept, rootfs, 67584)
+    assert script == [
+        "label: dos",
+        "unit: sectors",
+        "label-id: 0x12345678",
+        "start=2048, size=65536, type=c, bootable",
+        "start=67584, type=83",
+    ]
+
+
+def test_raw_partition_sizes_kb():
+    """The MBR extended partition does not count the logical partitions twice"""
+
+    def _part(num, start, size):
+        return {"part_num": num, "part_start": start, "part_end": start + size - 1,
+                "part_size": size}
+
+    partitions = [
+        _part(1, 1048576, 67108864),
+        _part(2, 68157440, 1073741824),
+        _part(3, 1141899264, 268435456),
+        _part(5, 1142947840, 134217728),
+        _part(6, 1278214144, 132120576),
+    ]
+    assert deploy._raw_partition_sizes_kb(partitions, "/dev/sda2") == \
+        (1048576, (67108864 + 134217728 + 132120576) / 1024)
+    assert deploy._raw_partition_sizes_kb(partitions[:3], "/dev/sda2") == \
+        (1048576, (67108864 + 268435456) / 1024)
@@ -1,5 +1,6 @@
 """Helpers for handling image.json file in a TEZI Image."""
 
+import fcntl
 import json
 import logging
 import os
@@ -14,6 +15,11 @@ log = logging.getLogger("torizon." + __name__)
 
 DEFAULT_IMAGE_JSON_FILENAME = "image.json"
 
+# Size of the pipe (and of the reads from it) used when decompressing files.
+PIPE_BUFFER_SIZE = 1024 * 1024
+# The fcntl module only has this constant since Python 3.10.
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+
 
 # TODO: It is advisable to test the usage of this class with every supported `config_format`.
 #       In particular, we should test it when new `config_format`s become available in TEZI.
@@ -161,18 +167,38 @@ class ImageConfig:
         """Get the size of a file possibly uncompressing it"""
 
         full_fname = os.path.join(image_dir, filename)
-        if unpack:
-            _output = subprocess.check_output(
-                "set -o pipefail; "
-                f"cat {shlex.quote(full_fname)} | {get_unpack_command(filename)} | wc -c",
-                shell=True)
-            size = int(_output)
+        if unpack and get_unpack_command(filename) != "cat":
+            size = ImageConfig._get_unpacked_size(full_fname, get_unpack_command(filename))
         else:
             stat = os.stat(full_fname)
             size = stat.st_size
         log.debug(f"Size of {full_fname} is {size} bytes.")
         return size
 
+    @staticmethod
+    def _get_unpacked_size(full_fname, unpack_command):
+        """Get the size of the data produced by decompressing a file"""
+
+        # Have the decompressor read the file directly and count its output here, with large
+        # reads from a large pipe: no shell, cat or wc involved.
+        with open(full_fname, "rb") as infile, \
+             subprocess.Popen(shlex.split(unpack_command), stdin=infile,
+                              stdout=subprocess.PIPE) as proc:
+            try:
+                fcntl.fcntl(proc.stdout.fileno(), F_SETPIPE_SZ, PIPE_BUFFER_SIZE)
+            except OSError:
+                # Not allowed to grow the pipe: the default size works as well.
+                pass
+            size = 0
+            while True:
+                chunk = proc.stdout.read(PIPE_BUFFER_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, unpack_command)
+        return size
+
     def search_filelist(self, src=None, tgt=None):
         """Search the 'filelist' for an entry with a given src and/or tgt"""
 